@@ -0,0 +1,105 @@
+'''
+Process-wide caches of the Streamlit app, shared by every session and user.
+The cached tables and explorers are shared objects: they must not be modified, copy them first.
+The Streamlit caches replay the elements drawn inside their functions on a cache hit,
+so nothing in here draws or updates an element: progress is reported out of `filtered_route`, which is not one of them.
+'''
+import copy
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+from data_process import download_and_process_data
+from path.artifact import RoutingArtifact
+from path.explorer import PathExplorer
+from path.finder import path_finder
+from path.optimizer import CSRGraph
+
+JOURNEY_CACHE_SIZE = 64  # journeys kept, the least recently used ones are evicted first
+ROUTE_CACHE_SIZE = 16  # filtered paths kept, one per (origin, direction, latitude boundary, number of neighbors)
+ARTIFACT_CACHE_SIZE = 4  # routing artifacts kept, one per latitude boundary, each covers the whole city table
+
+@st.cache_resource(show_spinner='Loading the cities...')
+def load_data():
+    '''City and country tables, loaded once per process. The display column is "city, country".'''
+    location_df, country_df, geojson_data = download_and_process_data(compact=True)
+    location_df['display'] = location_df['accent_city'] + ', ' + location_df['country'].astype(str)
+    return location_df, country_df, geojson_data
+
+@st.cache_resource(max_entries=ARTIFACT_CACHE_SIZE, show_spinner=False)
+def load_routing_artifact(lat_boundry):
+    location_df, _, _ = load_data()
+    return RoutingArtifact.build(location_df[['lat', 'lon']].values, lat_boundry=lat_boundry)
+
+class RouteCache:
+    """Least recently used explorers, shared by the sessions (threads) of the process."""
+    def __init__(self, max_entries=ROUTE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._routes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            route = self._routes.get(key)
+            if route is not None:
+                self._routes.move_to_end(key)
+            return route
+
+    def put(self, key, route):
+        with self._lock:
+            self._routes[key] = route
+            self._routes.move_to_end(key)
+            while len(self._routes) > self.max_entries:
+                self._routes.popitem(last=False)
+
+@st.cache_resource(show_spinner=False)
+def route_cache():
+    return RouteCache()
+
+def filtered_route(origin_index, direction, lat_boundry, n_neighbors, progress=None):
+    '''
+    Explorer of a route with its path filtered. The neighbors do not depend on the times and penalties,
+    so the journeys that only differ in those reweight a copy of it.
+    It is not a Streamlit cached function, so progress (callback of `PathExplorer.filter_path`) can update
+    an element of the page. The callback is only called when the route is not cached yet.
+    '''
+    key = (origin_index, direction, lat_boundry, n_neighbors)
+    route = route_cache().get(key)
+    if route is None:
+        route = _filter_route(origin_index, direction, lat_boundry, n_neighbors, progress)
+        route_cache().put(key, route)
+    return route
+
+def _filter_route(origin_index, direction, lat_boundry, n_neighbors, progress=None):
+    location_df, _, _ = load_data()
+    explorable_path = PathExplorer(location_df,
+                                   origin_city=location_df.loc[origin_index, 'city'],
+                                   origin_country=location_df.loc[origin_index, 'code'],
+                                   moving_direction=direction,
+                                   neighbors_times=[1] * n_neighbors,
+                                   add_hours_country=0,
+                                   add_hours_population=0,
+                                   population_limit=0)
+    explorable_path.prepare_explorable_path(load_routing_artifact(lat_boundry))
+    explorable_path.filter_path(progress=progress)
+    return explorable_path
+
+@st.cache_data(max_entries=JOURNEY_CACHE_SIZE, show_spinner=False)
+def compute_journey(origin_index, direction, lat_boundry, neighbors_times, add_hours_country, add_hours_population,
+                    population_limit):
+    '''
+    Memoized journey, keyed by all of its parameters (neighbors_times as a tuple).
+    Returns (path, cost, result_df) of `path_finder`, or None if the end is not reachable.
+    Call `filtered_route` first to report the progress of the filtering, the route is then already cached.
+    '''
+    route = filtered_route(origin_index, direction, lat_boundry, len(neighbors_times))
+    explorable_path = copy.copy(route)
+    explorable_path.explorable_path_df = route.explorable_path_df.copy()
+    explorable_path.edges = dict(route.edges)
+    explorable_path.reweight(neighbors_times=list(neighbors_times),
+                             add_hours_country=add_hours_country,
+                             add_hours_population=add_hours_population,
+                             population_limit=population_limit)
+    graph = CSRGraph.from_edges(explorable_path.edges, explorable_path.get_dataframe().index)
+    return path_finder(explorable_path, graph)
@@ -8,7 +8,7 @@ parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
 print(parent_dir)
 sys.path.append(parent_dir)
 
-from data_process import download_and_process_data
+from app.caching import load_data
 from plots.maps import MapBuilder
 
 st.set_page_config(page_title='Data', page_icon='📁', layout='wide')
@@ -26,15 +26,7 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-if 'location_df' not in st.session_state:
-    location_df, country_df, geojson_data = download_and_process_data()
-    st.session_state.location_df = location_df
-    st.session_state.country_df = country_df
-    st.session_state.geojson_data = geojson_data
-else:
-    location_df = st.session_state.location_df
-    country_df = st.session_state.country_df
-    geojson_data = st.session_state.geojson_data
+location_df, country_df, geojson_data = load_data()  # shared by every session, not to be modified
 
 st.subheader('🗂️ Dataset Preview') 
 st.markdown(
@@ -58,7 +50,7 @@ st.markdown(
 if 'df_input_number' not in st.session_state:
     st.session_state.df_input_number = 20 
     if 'filtered_data' not in st.session_state:
-        st.session_state.filtered_data = location_df.loc[:,~location_df.columns.isin(['geometry'])].head(st.session_state.df_input_number)
+        st.session_state.filtered_data = location_df.loc[:,~location_df.columns.isin(['geometry', 'display'])].head(st.session_state.df_input_number)
 
 col1, _, _, _ = st.columns(4) # for smaller user input
 df_input_number = col1.number_input(
@@ -70,7 +62,7 @@ df_input_number = col1.number_input(
 )
 
 st.session_state.df_input_number = df_input_number
-filtered_data = location_df.head(st.session_state.df_input_number)
+filtered_data = location_df.head(st.session_state.df_input_number).drop(columns=['display'])
 st.session_state.filtered_data = filtered_data
 
 st.dataframe(st.session_state.filtered_data) 
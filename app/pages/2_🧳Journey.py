@@ -1,21 +1,32 @@
+import json
 import os
 import sys
-import time
 
+import pandas as pd
 import streamlit as st
 
-from data_process import download_and_process_data
-from path.explorer import PathExplorer
-from path.finder import path_finder
-from path.optimizer import Graph, Edge, Vertex
-from plots.globe import JourneyPlanner
-from utils import identify_valid_points
-
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
 sys.path.append(parent_dir)
 
+import profiling
+from app.caching import compute_journey, filtered_route, load_data
+from plots.globe import JourneyPlanner
+
 st.set_page_config(page_title='Journey', page_icon='🧳', layout='wide')
 
+def progress_callback(progress_bar, start=0, stop=100):
+    '''
+    Callback of (steps done, total steps) that moves the progress bar from start to stop percent.
+    The bar is only updated when the percent changes.
+    '''
+    shown = [start]
+    def update(done, total):
+        percent = start + (stop - start) * done // max(total, 1)
+        if percent != shown[0]:
+            shown[0] = percent
+            progress_bar.progress(percent)
+    return update
+
 st.markdown(
     '''
     <style>
@@ -39,17 +50,8 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-if 'location_df' not in st.session_state:
-    location_df, country_df, geojson_data = download_and_process_data()
-    st.session_state.location_df = location_df
-    st.session_state.country_df = country_df
-    st.session_state.geojson_data = geojson_data
-else:
-    location_df = st.session_state.location_df
-    country_df = st.session_state.country_df
-    geojson_data = st.session_state.geojson_data
-
-location_df['display'] = location_df['accent_city'] + ', ' + location_df['country']
+location_df, country_df, geojson_data = load_data()  # shared by every session, not to be modified
+
 city_list = location_df['display'].sort_values().tolist()
 default_city = 'London' 
 
@@ -68,7 +70,7 @@ selected_option = col1.selectbox(
 st.session_state.selected_option = selected_option
 
 selected_city, selected_country = selected_option.split(', ')
-selected = location_df.query(f'accent_city == "{selected_city}" and country == "{selected_country}"').drop(columns=['geometry','display'])
+selected = location_df.query(f'accent_city == "{selected_city}" and country == "{selected_country}"').drop(columns=['geometry','display'], errors='ignore')
 st.dataframe(selected)
 selected = selected.index[0]
 
@@ -100,7 +102,8 @@ user_choice = cols[1].number_input('Latitude boundary',
                                    min_value=0.1, 
                                    max_value=10.0, 
                                    value=st.session_state.latiude_boundary,
-                                   help='The boundary is in degrees.')
+                                   help='The boundary is in degrees. The journey only goes through cities within it, '
+                                        'north or south of the origin.')
 
 st.session_state.latiude_boundary = user_choice
 latiude_boundary = st.session_state.latiude_boundary
@@ -217,16 +220,9 @@ if 'ready_to_proceed' not in st.session_state:
 
 ready_to_proceed = cols[1].checkbox("I am Ready!", value=st.session_state.ready_to_proceed)
 st.session_state.ready_to_proceed = ready_to_proceed
-
-explorable_path = PathExplorer(location_df,
-                                    origin_city=location_df.loc[selected]['city'],
-                                    origin_country=location_df.loc[selected]['code'],
-                                    moving_direction=direction,
-                                    neighbors_times=list(inputs.values()),
-                                    add_hours_country=added_country_hours,
-                                    add_hours_population=added_population_hours,
-                                    population_limit=population_limit)
-
+profile_journey = cols[1].checkbox('Profile the journey', value=False,
+                                   help='Records the time of each stage and a few counters of the next journey.')
+origin_city = location_df.loc[selected, 'city']
 
 cols = st.columns([1, 1, 1, 2, 1, 1, 1, 1, 1, 1])
 
@@ -239,158 +235,136 @@ if 'final_result' not in st.session_state:
 if 'metrics' not in st.session_state:
     st.session_state.metrics = {}
 
-if st.session_state.ready_to_proceed:
-    proceed_button = cols[4].button('GO!')
-
-    if proceed_button:
-        st.session_state.recalculate_journey = True
-        progress = st.progress(0)
-        status_text = st.empty()
-
-        total_steps = 6
-        step_increment = 100 // total_steps
-
-        status_text.text('Exploring the Path...')
-        time.sleep(0.5)
-
-        valid_neighbors = identify_valid_points(location_df[['lat', 'lon']].values, lat_boundry=0.5)
-        progress.progress(step_increment * 2)
-
-        status_text.text('Identifying Valid Points...')
-        time.sleep(0.5)
-
-        explorable_path.prepare_explorable_path(valid_neighbors)
-        progress.progress(step_increment * 3)
-
-        status_text.text('Staying on Course...')
-        time.sleep(0.5)
-
-        explorable_path.filter_path()
-        progress.progress(step_increment * 4)
-
-        status_text.text('Creating Potential Path Dataframe...')
-        time.sleep(0.5)
-
-        explorable_path_df = explorable_path.get_dataframe()
-        progress.progress(step_increment * 5)
-
-        status_text.text('Creating the Graph and Finding the Path...')
-        time.sleep(0.5)
-
-        vertices_dict = {index: Vertex(index, row['lon']) for index, row in explorable_path_df.iterrows()}
-        adjacency_list = {vertex: [] for vertex in vertices_dict.values()}
-
-        for idx, row in explorable_path_df.iterrows():
-            from_vertex = vertices_dict[idx]
-            for adj, cost in zip(row['adjacency_list'], row['distance_edges']):
-                to_vertex = vertices_dict[adj]
-                adjacency_list[from_vertex].append(Edge(cost, to_vertex))
-
-        graph = Graph(adjacency_list)
-
-        progress.progress(100)
-        status_text.text('Best Path Found!')
-
-        path, cost, result = path_finder(explorable_path, graph, vertices_dict)
-
-        time.sleep(1)
-
-        status_text.text('')
-        st.success('Journey Complete!')
-
-        time.sleep(0.5)
-
-        final_result = result.loc[:, ~result.columns.isin(['code', 'geometry', 'display', 'lon_order', 'region', 'lat_rad', 'lon_rad'])]
-        final_result.rename(columns={'pop_est': 'country_population'}, inplace=True)
-        final_result['pace'] = final_result['next_point_distance'] / final_result['normed_next_point_duration']
-        final_result['#'] = [i + 1 for i in range(len(final_result))]
-
-        total_time_days = int(final_result['normed_next_point_duration'].sum() // 24)
-        total_time_hours = int(final_result['normed_next_point_duration'].sum() % 24)
-        total_distance = final_result['next_point_distance'].sum()
-        final_pace = total_distance / (total_time_days + total_time_hours)
-        cities_explored = len(final_result)
-        countries_explored = final_result['country'].nunique()
-        average_pace = (final_result['pace']).mean()
-
-        st.session_state.final_result = final_result
-
-        st.session_state.metrics = {
-            'total_time_days': total_time_days,
-            'total_time_hours': total_time_hours,
-            'total_distance': total_distance,
-            'final_pace': final_pace,
-            'cities_explored': cities_explored,
-            'countries_explored': countries_explored,
-            'average_pace': average_pace
-        }
-
-        st.session_state.journey_complete = True
-
-if st.session_state.journey_complete:
-    metrics = st.session_state.metrics
-    final_result = st.session_state.final_result
-
-    st.markdown('<strong>📄 Report Metrics</strong>', unsafe_allow_html=True)
-    st.markdown('<hr style="border: 1px solid #D3D3D3;">', unsafe_allow_html=True)
-
-    report_cols = st.columns([2, 1, 1, 1, 2])
-    report_cols[0].metric(label='Total Distance Traveled', value=f"{metrics['total_distance']:,} km")
-    report_cols[0].metric(label='Total Time Spent', value=f"{metrics['total_time_days']} days\n{metrics['total_time_hours']} hours")
-    report_cols[2].metric(label='Cities Explored', value=metrics['cities_explored'])
-    report_cols[2].metric(label='Countries Explored', value=metrics['countries_explored'])
-    report_cols[-1].metric(label='Final Pace', value=f"{metrics['final_pace']:.2f} km/h")
-    report_cols[-1].metric(label='Average Pace', value=f"{metrics['average_pace']:.2f} km/h")
-
-    st.markdown('<strong>🛣️ The Shortest Path</strong>', unsafe_allow_html=True)
-    st.dataframe(final_result[['#', 'accent_city', 'country', 'population', 'lat', 'lon', 'country_lat',
-                                'country_lon', 'country_population', 'continent', 'adjacency_list', 'time_edges',
-                                'distance_edges', 'next_point_duration', 'next_point_distance',
-                                'normed_next_point_duration', 'distance_normalized', 'pace']])
-
-    with st.expander('More info on the path dataframe'):
-        st.markdown(
-        '''
-        <strong>Dataframe Details:</strong><br>
-        - <em>adjacency_list:</em> Indexes of closest neighbors.<br>
-        - <em>time_edges:</em> Time to travel to neighbors.<br>
-        - <em>distance_edges:</em> Distance to neighbors.<br>
-        - <em>distance_normalized:</em> Normalized distance.<br>
-        - <em>normed_next_point_duration:</em> Adjusted duration based on distance.
-        ''',
-        unsafe_allow_html=True
-    )
-
-    st.markdown('<strong>🌏 Full Circle</strong>', unsafe_allow_html=True)
-    if 'journey' not in st.session_state or st.session_state.recalculate_journey:
-        globe = JourneyPlanner(final_result, explorable_path.moving_direction, explorable_path.origin_city)
-
-        status_text = st.empty() 
-        
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        total_steps = 10 
-        step_increment = 100 // total_steps
-
-        for step in range(total_steps-1):
-            progress_bar.progress(step_increment * (step + 1))
-            status_text.text(f'Processing...')
-            time.sleep(0.5) 
-
-        journey = globe.show()
-        st.session_state['globe'] = globe
-        st.session_state['journey'] = journey
-
-        st.session_state.recalculate_journey = False
-
-        status_text.text('Process Finished!')
-
-        st.success('Globe Complete!')
-        progress_bar.progress(100)
-
-    st.plotly_chart(st.session_state['journey'], use_container_width=False)
+# the profiler records the journey and the globe of this run only, it is stopped even if they fail
+try:
+    if st.session_state.ready_to_proceed:
+        proceed_button = cols[4].button('GO!')
+
+        if proceed_button:
+            st.session_state.recalculate_journey = True
+            st.session_state.profile = None
+            if profile_journey:
+                profiling.enable()
+            progress = st.progress(0)
+            status_text = st.empty()
+            status_text.text('Exploring the Path and Finding the Best One...')
+
+            # journeys are memoized for every session, the same parameters are only computed once
+            # the filtering of the path reports its rows in the first 60% of the bar, the search takes the rest;
+            # it runs outside of the cached compute_journey, which must not update the elements of the page
+            try:
+                filtered_route(selected, direction, latiude_boundary, len(inputs), progress=progress_callback(progress, 0, 60))
+                journey_found = compute_journey(selected, direction, latiude_boundary, tuple(inputs.values()),
+                                                added_country_hours, added_population_hours, population_limit)
+            except ValueError as error:  # e.g. not enough points within the latitude boundary
+                st.error(f'{error} Try a larger latitude boundary.')
+                st.stop()
+            if journey_found is None:
+                st.error('No complete path found around the world! Try a larger latitude boundary.')
+                st.stop()
+
+            progress.progress(100)
+            status_text.text('Best Path Found!')
+
+            path, cost, result = journey_found
+
+            status_text.text('')
+            st.success('Journey Complete!')
+
+            final_result = result.loc[:, ~result.columns.isin(['code', 'geometry', 'display', 'lon_order', 'region', 'lat_rad', 'lon_rad'])]
+            final_result.rename(columns={'pop_est': 'country_population'}, inplace=True)
+            final_result['pace'] = final_result['next_point_distance'] / final_result['normed_next_point_duration']
+            final_result['#'] = [i + 1 for i in range(len(final_result))]
+
+            total_time_days = int(final_result['normed_next_point_duration'].sum() // 24)
+            total_time_hours = int(final_result['normed_next_point_duration'].sum() % 24)
+            total_distance = final_result['next_point_distance'].sum()
+            final_pace = total_distance / (total_time_days + total_time_hours)
+            cities_explored = len(final_result)
+            countries_explored = final_result['country'].nunique()
+            average_pace = (final_result['pace']).mean()
+
+            st.session_state.final_result = final_result
+
+            st.session_state.metrics = {
+                'total_time_days': total_time_days,
+                'total_time_hours': total_time_hours,
+                'total_distance': total_distance,
+                'final_pace': final_pace,
+                'cities_explored': cities_explored,
+                'countries_explored': countries_explored,
+                'average_pace': average_pace
+            }
+
+            st.session_state.journey_complete = True
+
+    if st.session_state.journey_complete:
+        metrics = st.session_state.metrics
+        final_result = st.session_state.final_result
+
+        st.markdown('<strong>📄 Report Metrics</strong>', unsafe_allow_html=True)
+        st.markdown('<hr style="border: 1px solid #D3D3D3;">', unsafe_allow_html=True)
+
+        report_cols = st.columns([2, 1, 1, 1, 2])
+        report_cols[0].metric(label='Total Distance Traveled', value=f"{metrics['total_distance']:,} km")
+        report_cols[0].metric(label='Total Time Spent', value=f"{metrics['total_time_days']} days\n{metrics['total_time_hours']} hours")
+        report_cols[2].metric(label='Cities Explored', value=metrics['cities_explored'])
+        report_cols[2].metric(label='Countries Explored', value=metrics['countries_explored'])
+        report_cols[-1].metric(label='Final Pace', value=f"{metrics['final_pace']:.2f} km/h")
+        report_cols[-1].metric(label='Average Pace', value=f"{metrics['average_pace']:.2f} km/h")
+
+        st.markdown('<strong>🛣️ The Shortest Path</strong>', unsafe_allow_html=True)
+        st.dataframe(final_result[['#', 'accent_city', 'country', 'population', 'lat', 'lon', 'country_lat',
+                                    'country_lon', 'country_population', 'continent', 'adjacency_list', 'time_edges',
+                                    'distance_edges', 'next_point_duration', 'next_point_distance',
+                                    'normed_next_point_duration', 'distance_normalized', 'pace']])
+
+        with st.expander('More info on the path dataframe'):
+            st.markdown(
+            '''
+            <strong>Dataframe Details:</strong><br>
+            - <em>adjacency_list:</em> Indexes of closest neighbors.<br>
+            - <em>time_edges:</em> Time to travel to neighbors.<br>
+            - <em>distance_edges:</em> Distance to neighbors.<br>
+            - <em>distance_normalized:</em> Normalized distance.<br>
+            - <em>normed_next_point_duration:</em> Adjusted duration based on distance.
+            ''',
+            unsafe_allow_html=True
+        )
+
+        st.markdown('<strong>🌏 Full Circle</strong>', unsafe_allow_html=True)
+        if 'journey' not in st.session_state or st.session_state.recalculate_journey:
+            globe = JourneyPlanner(final_result, direction, origin_city)
+
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            status_text.text('Drawing the Globe...')
+
+            journey = globe.show(progress=progress_callback(progress_bar), lean=True)
+            st.session_state['globe'] = globe
+            st.session_state['journey'] = journey
+
+            st.session_state.recalculate_journey = False
+            if profiling.is_enabled():
+                st.session_state.profile = profiling.to_json(origin=selected_option, direction=direction,
+                                                             neighbors_times=list(inputs.values()))
+
+            status_text.text('Process Finished!')
+
+            st.success('Globe Complete!')
+            progress_bar.progress(100)
+
+        st.plotly_chart(st.session_state['journey'], use_container_width=False)
+
+        if st.session_state.get('profile'):
+            with st.expander('⏱️ Profiling'):
+                profile = json.loads(st.session_state.profile)
+                st.dataframe(pd.DataFrame.from_dict(profile['stages'], orient='index'))
+                st.json(profile['counters'])
+                st.download_button('Download JSON', st.session_state.profile, file_name='profile.json')
     
-else:
-    cols = st.columns([1, 1, 1])
-    cols[1].info('Click "I am Ready" and then "GO" to start the Journey!')
\ No newline at end of file
+    else:
+        cols = st.columns([1, 1, 1])
+        cols[1].info('Click "I am Ready" and then "GO" to start the Journey!')
+finally:
+    profiling.disable()
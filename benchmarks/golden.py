@@ -0,0 +1,206 @@
+'''
+Golden-output regression harness.
+Records the journeys of the reference pipeline (dense valid points, iterative filter_path, object Graph dijkstra)
+on the fixture and synthetic datasets, for several origins, both directions and several penalty settings,
+and diffs every other engine against them: chosen cities, hours and distances must match exactly.
+A* and bidirectional search may pick another path of the same distance (cost): those journeys are not
+reported as ok but as a named difference, "same cost, other path", and as failures with --strict.
+
+Usage (from the repository root):
+    python -m benchmarks.golden record
+    python -m benchmarks.golden check
+    python -m benchmarks.golden check --engines vectorized astar --datasets synthetic
+    python -m benchmarks.golden check --strict
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import warnings
+
+from benchmarks.suite import object_graph
+from benchmarks.synthetic import generate_cities
+from path.artifact import RoutingArtifact
+from path.explorer import PathExplorer
+from path.finder import path_finder
+from path.optimizer import CSRGraph
+from utils import LatitudeBandIndex, identify_valid_points
+
+warnings.filterwarnings('ignore')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIR = os.path.join(ROOT, 'data', 'fixtures')
+GOLDEN_DIR = os.path.join(ROOT, 'data', 'golden')
+LAT_BOUNDRY = 0.5
+
+PENALTIES = [
+    {'neighbors_times': [2,4,8], 'add_hours_country': 2, 'add_hours_population': 2, 'population_limit': 200_000},
+    {'neighbors_times': [1,3,9], 'add_hours_country': 5, 'add_hours_population': 1, 'population_limit': 50_000},
+    {'neighbors_times': [2,3,5,7], 'add_hours_country': 0, 'add_hours_population': 4, 'population_limit': 1_000_000},
+]
+
+# valid_neighbors: "dense" matrix, "band" index or routing "artifact"
+# reweight: filter with other times and penalties first, then reweight to the case's ones
+# cost_only: the search is only guaranteed to find a path of the same cost (distance), when several exist
+# it can pick another one, so it may differ in the cities and hours: such a journey is a named difference, not a pass
+ENGINES = {
+    'reference': {'valid_neighbors': 'dense', 'filter': 'iterative', 'graph': 'object', 'search': 'dijkstra'},
+    'vectorized': {'valid_neighbors': 'band', 'filter': 'vectorized', 'graph': 'csr', 'search': 'dijkstra'},
+    'artifact': {'valid_neighbors': 'artifact', 'filter': 'vectorized', 'graph': 'csr', 'search': 'dijkstra'},
+    'reweighted': {'valid_neighbors': 'band', 'filter': 'vectorized', 'graph': 'csr', 'search': 'dijkstra',
+                   'reweight': True},
+    'compact': {'valid_neighbors': 'band', 'filter': 'vectorized', 'graph': 'csr', 'search': 'dijkstra',
+                'compact': True},
+    'astar': {'valid_neighbors': 'band', 'filter': 'vectorized', 'graph': 'csr', 'search': 'astar',
+              'cost_only': True},
+    'bidirectional': {'valid_neighbors': 'band', 'filter': 'vectorized', 'graph': 'csr', 'search': 'bidirectional',
+                      'cost_only': True},
+}
+
+def load_dataset(name):
+    '''City table and journey origins of a dataset.'''
+    if name == 'fixture':
+        from data_process import process_data
+
+        location_df, _, _ = process_data(os.path.join(FIXTURE_DIR, 'cities.csv'),
+                                         os.path.join(FIXTURE_DIR, 'countries.geo.json'),
+                                         os.path.join(FIXTURE_DIR, 'world.geojson'))
+        origins = [('london', 'GB'), ('berlin', 'DE'), ('moscow', 'RU')]
+    elif name == 'synthetic':
+        location_df = generate_cities(4_000, seed=7, lat_spread=3)
+        by_population = location_df.sort_values('population', ascending=False)
+        origins = [tuple(row) for row in by_population[['city', 'code']].iloc[[0, 10, 100]].values]
+    else:
+        raise ValueError('Invalid dataset. Must be "fixture" or "synthetic".')
+    return location_df, origins
+
+def run_journey(location_df, origin, direction, penalties, engine, valid_neighbors):
+    '''Runs one journey with an engine of ENGINES and returns its canonical summary.'''
+    if engine.get('compact'):
+        from data_process import compact_location_data
+
+        location_df = compact_location_data(location_df)
+    initial = penalties
+    if engine.get('reweight'):
+        initial = {'neighbors_times': [1] * len(penalties['neighbors_times']), 'add_hours_country': 1,
+                   'add_hours_population': 1, 'population_limit': 10}
+    explorable_path = PathExplorer(location_df,
+                                   origin_city=origin[0],
+                                   origin_country=origin[1],
+                                   moving_direction=direction,
+                                   **initial)
+    explorable_path.prepare_explorable_path(valid_neighbors[engine['valid_neighbors']])
+    explorable_path.filter_path(engine=engine['filter'])
+    if engine.get('reweight'):
+        explorable_path.reweight(**penalties)
+
+    data = explorable_path.get_dataframe()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine['graph'] == 'object':
+            graph, vertices = object_graph(data)
+            found = path_finder(explorable_path, graph, vertices, search=engine['search'])
+        else:
+            graph = CSRGraph.from_edges(explorable_path.edges, data.index)
+            found = path_finder(explorable_path, graph, search=engine['search'])
+
+    case = {'origin': list(origin), 'direction': direction, 'penalties': penalties}
+    if found is None:
+        return {**case, 'status': 'incomplete'}
+    path, cost, result = found
+    return {
+        **case,
+        'status': 'ok',
+        'cost': int(cost),
+        'path': [int(label) for label in path],
+        'cities': result['city'].astype(str).tolist(),
+        'next_point_duration': [int(value) for value in result['next_point_duration']],
+        'next_point_distance': [int(value) for value in result['next_point_distance']],
+        'normed_next_point_duration': [float(value) for value in result['normed_next_point_duration']],
+        'total_hours': float(result['normed_next_point_duration'].sum()),
+        'total_distance': int(result['next_point_distance'].sum()),
+    }
+
+def run_cases(dataset, engine_name):
+    location_df, origins = load_dataset(dataset)
+    points = location_df[['lat', 'lon']].values
+    engine = ENGINES[engine_name]
+    valid_neighbors = {
+        'dense': identify_valid_points(points, lat_boundry=LAT_BOUNDRY) if engine['valid_neighbors'] == 'dense' else None,
+        'band': LatitudeBandIndex(points, lat_boundry=LAT_BOUNDRY),
+        'artifact': RoutingArtifact.build(points, lat_boundry=LAT_BOUNDRY),
+    }
+    return [run_journey(location_df, origin, direction, penalties, engine, valid_neighbors)
+            for origin in origins for direction in ['E', 'W'] for penalties in PENALTIES]
+
+def golden_path(dataset):
+    return os.path.join(GOLDEN_DIR, f'{dataset}.json')
+
+def record(datasets):
+    '''Records the reference outputs of the datasets.'''
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for dataset in datasets:
+        cases = run_cases(dataset, 'reference')
+        with open(golden_path(dataset), 'w') as file:
+            json.dump({'dataset': dataset, 'engine': ENGINES['reference'], 'cases': cases}, file)
+        print(f'{dataset}: {len(cases)} journeys recorded in {golden_path(dataset)}')
+
+def diff_case(expected, actual):
+    '''Names of the fields that differ, empty when the journeys match.'''
+    fields = sorted(set(expected) | set(actual))
+    return [field for field in fields if expected.get(field) != actual.get(field)]
+
+def check(datasets, engines, verbose=False, strict=False):
+    '''
+    Diffs the engines against the recorded outputs. Returns the number of mismatching journeys.
+    For the cost_only engines, another path of the same cost is reported as "same cost, other path",
+    it is only counted as a mismatch if strict.
+    '''
+    mismatches = 0
+    for dataset in datasets:
+        with open(golden_path(dataset)) as file:
+            golden = json.load(file)['cases']
+        for engine_name in engines:
+            cost_only = ENGINES[engine_name].get('cost_only', False)
+            cases = run_cases(dataset, engine_name)
+            failed = alternatives = 0
+            for expected, actual in zip(golden, cases):
+                fields = diff_case(expected, actual)
+                if not fields:
+                    continue
+                alternative = cost_only and not set(fields) - {'path', 'cities', 'next_point_duration',
+                                                               'next_point_distance', 'normed_next_point_duration',
+                                                               'total_hours', 'total_distance'}
+                alternatives += alternative
+                failed += not alternative
+                if verbose or not alternative:
+                    difference = 'same cost, other path' if alternative else f'differs in {", ".join(fields)}'
+                    print(f'  {dataset}/{engine_name}: {expected["origin"][0]} {expected["direction"]} '
+                          f'{expected["penalties"]["neighbors_times"]} {difference}')
+            statuses = []
+            if failed:
+                statuses.append(f'{failed} of {len(golden)} journeys differ')
+            if alternatives:
+                statuses.append(f'same cost, other path in {alternatives} of {len(golden)} journeys')
+            print(f'{dataset}/{engine_name}: {"; ".join(statuses) or "ok"}')
+            mismatches += failed + (alternatives if strict else 0)
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description='Records and checks the golden journey outputs.')
+    parser.add_argument('command', choices=['record', 'check'])
+    parser.add_argument('--datasets', nargs='+', default=['fixture', 'synthetic'], choices=['fixture', 'synthetic'])
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--verbose', action='store_true', help='Also list the journeys with the same cost on another path.')
+    parser.add_argument('--strict', action='store_true',
+                        help='Count the journeys with the same cost on another path as mismatches.')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.datasets)
+    else:
+        sys.exit(1 if check(args.datasets, args.engines, args.verbose, args.strict) else 0)
+
+if __name__ == '__main__':
+    main()
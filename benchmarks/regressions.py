@@ -0,0 +1,74 @@
+'''
+Regression checks of edge cases that the golden journeys do not reach.
+Each check raises AssertionError when the behaviour it pins down is broken, any other error is a failure too.
+
+Usage (from the repository root):
+    python -m benchmarks.regressions
+    python -m benchmarks.regressions --checks heap_requeue
+'''
+import argparse
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from path.finder import find_start_and_end
+from path.optimizer import IndexedHeap
+from utils import determine_closest_points
+
+def check_heap_requeue():
+    '''Pushing a queued task again at the same priority moves it after its ties.'''
+    queue = IndexedHeap(3)
+    for priority, task in [(1, 0), (1, 1), (1, 2), (1, 0)]:
+        queue.push(priority, task)
+    popped = [queue.pop()[1] for _ in range(3)]
+    assert popped == [1, 2, 0], f'popped {popped}, expected [1, 2, 0]'
+
+def check_closest_points_few_points():
+    '''With n or fewer other points, both modes return valid indices, the source filling the missing neighbors.'''
+    for points, n, expected in [([[10, .5]], 1, [[0]]), ([[10, .5], [10, 1.5]], 1, [[1], [0]])]:
+        for mode in ['degrees', 'sphere']:
+            closest = determine_closest_points(np.array(points), n=n, mode=mode)
+            assert closest.tolist() == expected, f'{mode} mode gave {closest.tolist()}, expected {expected}'
+    for mode in ['degrees', 'sphere']:
+        closest = determine_closest_points(np.array([[10, .5], [10, 1.5]]), n=3, mode=mode)
+        assert closest.max() < 2, f'{mode} mode gave {closest.tolist()}, indices out of range'
+
+def check_end_of_first_longitude():
+    '''An origin with the smallest lon_order is its own end, in both modes.'''
+    data = pd.DataFrame({'city': ['a', 'b', 'c'], 'code': ['AA'] * 3, 'lat': [10., 10., 10.],
+                         'lon': [.5, 30., 60.], 'lon_order': [0, 30, 60]})
+    for mode in ['degrees', 'sphere']:
+        explorable_path = SimpleNamespace(get_dataframe=lambda: data, origin_city='a', origin_country='AA',
+                                          neighbor_mode=mode)
+        ends = find_start_and_end(explorable_path)
+        assert tuple(map(int, ends)) == (0, 0), f'{mode} mode gave {ends}, expected (0, 0)'
+
+CHECKS = {
+    'heap_requeue': check_heap_requeue,
+    'closest_points_few_points': check_closest_points_few_points,
+    'end_of_first_longitude': check_end_of_first_longitude,
+}
+
+def run(names):
+    '''Runs the checks and returns the number of failures.'''
+    failures = 0
+    for name in names:
+        try:
+            CHECKS[name]()
+        except Exception as error:
+            failures += 1
+            print(f'{name}: failed, {type(error).__name__}: {error}')
+        else:
+            print(f'{name}: ok')
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the edge case regression checks.')
+    parser.add_argument('--checks', nargs='+', default=list(CHECKS), choices=list(CHECKS))
+    args = parser.parse_args()
+    sys.exit(1 if run(args.checks) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''
+Compares the search modes of `path_finder` on the same journey graph.
+Reports the settled vertices and the wall time of each mode.
+
+Usage (from the repository root):
+    python -m benchmarks.search_modes --city london --country GB --direction E
+    python -m benchmarks.search_modes --synthetic 50000
+'''
+import argparse
+import time
+import warnings
+
+from benchmarks.synthetic import generate_cities, largest_city
+from data_process import download_and_process_data
+from path.explorer import PathExplorer
+from path.finder import find_start_and_end, longitude_heuristic
+from path.optimizer import CSRGraph, astar_csr, bidirectional_dijkstra_csr, dijkstra_csr
+from utils import LatitudeBandIndex
+
+warnings.filterwarnings('ignore')
+
+def build_journey_graph(location_df, city, country, direction, lat_boundry=0.5):
+    explorable_path = PathExplorer(location_df,
+                                   origin_city=city,
+                                   origin_country=country,
+                                   moving_direction=direction,
+                                   neighbors_times=[2,4,8],
+                                   add_hours_country=2,
+                                   add_hours_population=2,
+                                   population_limit=200_000)
+    explorable_path.prepare_explorable_path(LatitudeBandIndex(location_df[['lat', 'lon']].values, lat_boundry=lat_boundry))
+    explorable_path.filter_path()
+    return explorable_path, CSRGraph.from_edges(explorable_path.edges, explorable_path.get_dataframe().index)
+
+def compare_search_modes(explorable_path, graph, repeat=3):
+    data = explorable_path.get_dataframe()
+    origin_index, end_index = find_start_and_end(explorable_path)
+    start, end = graph.vertex_id(origin_index), graph.vertex_id(end_index)
+
+    searches = {
+        'dijkstra': lambda stats: dijkstra_csr(graph, start, end, stats=stats),
+        'astar': lambda stats: astar_csr(graph, start, end, longitude_heuristic(
+            graph, data.loc[graph.labels, 'lon'].values, start, end, explorable_path.moving_direction), stats=stats),
+        'bidirectional': lambda stats: bidirectional_dijkstra_csr(graph, start, end, stats=stats),
+    }
+    results = []
+    for mode, search in searches.items():
+        timings = []
+        for _ in range(repeat):
+            stats = {}
+            started = time.perf_counter()
+            _, cost = search(stats)
+            timings.append(time.perf_counter() - started)
+        results.append({'mode': mode, 'settled': stats['settled'], 'seconds': min(timings), 'cost': cost})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Settled vertices and wall time of each search mode.')
+    parser.add_argument('--city', default='london')
+    parser.add_argument('--country', default='GB')
+    parser.add_argument('--direction', default='E', choices=['E', 'W'])
+    parser.add_argument('--lat-boundary', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--synthetic', type=int, help='Number of synthetic cities to use instead of the dataset, '
+                                                      'starting from the largest one.')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        location_df = generate_cities(args.synthetic)
+        args.city, args.country = largest_city(location_df)
+    else:
+        location_df, _, _ = download_and_process_data()
+    explorable_path, graph = build_journey_graph(location_df, args.city, args.country, args.direction, args.lat_boundary)
+
+    print(f'{len(graph):,} vertices, {len(graph.indices):,} edges')
+    print(f'{"mode":<15}{"settled":>10}{"seconds":>10}{"cost":>10}')
+    for result in compare_search_modes(explorable_path, graph, args.repeat):
+        print(f'{result["mode"]:<15}{result["settled"]:>10,}{result["seconds"]:>10.4f}{result["cost"]:>10,}')
+
+if __name__ == '__main__':
+    main()
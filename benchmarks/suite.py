@@ -0,0 +1,171 @@
+'''
+Times the main stages of the pipeline on synthetic city tables of increasing size.
+Reports the best wall time of a few runs and the peak memory (tracemalloc) of one run,
+and saves the results as JSON to compare them with a previous run.
+
+Usage (from the repository root):
+    python -m benchmarks.suite --sizes 2000 10000 50000 --out benchmarks/results/after.json
+    python -m benchmarks.suite --sizes 2000 10000 --compare benchmarks/results/before.json
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_cities, largest_city
+from path.explorer import PathExplorer
+from path.finder import find_start_and_end, path_finder
+from path.optimizer import CSRGraph, Edge, Graph, Vertex, dijkstra, dijkstra_csr
+from utils import LatitudeBandIndex, determine_closest_points, identify_valid_points
+
+warnings.filterwarnings('ignore')
+
+def measure(func, setup=None, repeat=3):
+    '''
+    Best wall time of `repeat` runs of func(setup()) and the peak memory of one more run.
+    The setup is not timed.
+    '''
+    setup = setup or (lambda: None)
+    timings = []
+    for _ in range(repeat):
+        state = setup()
+        started = time.perf_counter()
+        func(state)
+        timings.append(time.perf_counter() - started)
+
+    state = setup()
+    tracemalloc.start()
+    func(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(min(timings), 6), 'peak_mb': round(peak / 2**20, 3)}
+
+def object_graph(data):
+    '''The Vertex/Edge graph of the explorable path, for the object based dijkstra.'''
+    vertices = {index: Vertex(index, lon) for index, lon in zip(data.index, data['lon'])}
+    adjacency_list = {vertex: [] for vertex in vertices.values()}
+    for index, neighbors, distances in zip(data.index, data['adjacency_list'], data['distance_edges']):
+        adjacency_list[vertices[index]] = [Edge(cost, vertices[neighbor]) for neighbor, cost in zip(neighbors, distances)]
+    return Graph(adjacency_list), vertices
+
+def benchmark_size(n, seed=0, lat_boundry=0.5, repeat=3, dense_limit=20_000, iterative_limit=5_000):
+    '''Runs every benchmark on a synthetic table of n cities, returns one result per benchmark.'''
+    location_df = generate_cities(n, seed=seed)
+    points = location_df[['lat', 'lon']].values
+    city, code = largest_city(location_df)
+    band_index = LatitudeBandIndex(points, lat_boundry=lat_boundry)
+
+    def explorer():
+        explorable_path = PathExplorer(location_df,
+                                       origin_city=city,
+                                       origin_country=code,
+                                       moving_direction='E',
+                                       neighbors_times=[2,4,8],
+                                       add_hours_country=2,
+                                       add_hours_population=2,
+                                       population_limit=200_000)
+        explorable_path.prepare_explorable_path(band_index)
+        return explorable_path
+
+    explorable_path = explorer()
+    explorable_path.filter_path()
+    path_rows = len(explorable_path.get_dataframe())
+
+    results = []
+    def add(name, result, rows=n):
+        results.append({'benchmark': name, 'n': n, 'rows': rows, **result})
+        print(f'{name:<30}{n:>10,}{rows:>10,}{result["seconds"]:>12.4f}{result["peak_mb"]:>12.1f}')
+
+    if n <= dense_limit:
+        add('identify_valid_points', measure(lambda _: identify_valid_points(points, lat_boundry), repeat=repeat))
+    add('determine_closest_points', measure(lambda _: determine_closest_points(points, n=3), repeat=repeat))
+    add('filter_path', measure(lambda e: e.filter_path(), setup=explorer, repeat=repeat), path_rows)
+    if path_rows <= iterative_limit:
+        add('filter_path[iterative]', measure(lambda e: e.filter_path(engine='iterative'), setup=explorer,
+                                              repeat=repeat), path_rows)
+
+    data = explorable_path.get_dataframe()
+    origin_index, end_index = find_start_and_end(explorable_path)
+    graph, vertices = object_graph(data)
+    csr_graph = CSRGraph.from_edges(explorable_path.edges, data.index)
+    with contextlib.redirect_stdout(io.StringIO()):  # the searches print when the end is not reachable
+        object_search = measure(lambda _: dijkstra(graph, vertices[origin_index], vertices[end_index]), repeat=repeat)
+        csr_search = measure(lambda _: dijkstra_csr(csr_graph, csr_graph.vertex_id(origin_index),
+                                                    csr_graph.vertex_id(end_index)), repeat=repeat)
+        found = path_finder(explorable_path, csr_graph)
+    add('dijkstra', object_search, path_rows)
+    add('dijkstra_csr', csr_search, path_rows)
+
+    try:
+        from plots.globe import JourneyPlanner
+    except ImportError as error:
+        print(f'create_fig_data skipped: {error}')
+    else:
+        if found is not None:
+            result = found[2]
+            add('create_fig_data', measure(lambda planner: planner.create_fig_data(),
+                                           setup=lambda: JourneyPlanner(result, 'E', city), repeat=repeat), len(result))
+    return results
+
+def compare(results, baseline):
+    '''Prints the time and memory ratios to a previous run, for the benchmarks of both.'''
+    previous = {(result['benchmark'], result['n']): result for result in baseline['results']}
+    print(f'\n{"benchmark":<30}{"n":>10}{"time x":>12}{"memory x":>12}')
+    for result in results:
+        before = previous.get((result['benchmark'], result['n']))
+        if before is None:
+            continue
+        time_ratio = result['seconds'] / before['seconds'] if before['seconds'] else float('nan')
+        memory_ratio = result['peak_mb'] / before['peak_mb'] if before['peak_mb'] else float('nan')
+        print(f'{result["benchmark"]:<30}{result["n"]:>10,}{time_ratio:>12.2f}{memory_ratio:>12.2f}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the pipeline on synthetic cities.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2_000, 10_000, 50_000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lat-boundary', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dense-limit', type=int, default=20_000,
+                        help='Largest size for identify_valid_points, which builds an NxN matrix.')
+    parser.add_argument('--iterative-limit', type=int, default=5_000,
+                        help='Largest explorable path for the iterative filter_path engine.')
+    parser.add_argument('--out', help='JSON file of the results.')
+    parser.add_argument('--compare', help='JSON file of a previous run.')
+    args = parser.parse_args()
+
+    print(f'{"benchmark":<30}{"n":>10}{"rows":>10}{"seconds":>12}{"peak MB":>12}')
+    results = []
+    for n in args.sizes:
+        results += benchmark_size(n, args.seed, args.lat_boundary, args.repeat, args.dense_limit, args.iterative_limit)
+
+    report = {
+        'metadata': {
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'\nResults saved in {args.out}')
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+Seeded synthetic city tables with the columns of `download_and_process_data`, for offline benchmarks.
+The same arguments always give the same table.
+'''
+import numpy as np
+import pandas as pd
+
+LAT_DISTRIBUTIONS = ['normal', 'uniform', 'bands']
+POPULATION_DISTRIBUTIONS = ['lognormal', 'pareto']
+
+def generate_cities(n=10_000,
+                    seed=0,
+                    lat_distribution='normal',
+                    lat_center=50,
+                    lat_spread=5,
+                    n_countries=40,
+                    population_distribution='lognormal',
+                    duplicate_lon_fraction=0.05):
+    '''
+    Generates a city table of n cities.
+    Input:
+        n: number of cities (before dropping the duplicated coordinates, like `process_data`)
+        seed: seed of the random generator
+        lat_distribution: "normal" around lat_center with lat_spread as standard deviation,
+                          "uniform" in [lat_center - lat_spread, lat_center + lat_spread],
+                          "bands" normal around three latitudes (lat_center and +/- 2 * lat_spread)
+        n_countries: countries are contiguous longitude strips of random widths
+        population_distribution: "lognormal" or "pareto" (heavy tailed, few very large cities)
+        duplicate_lon_fraction: fraction of the cities that share their longitude with another one
+    Output:
+        loc_df with code, city, accent_city, population, lat, lon, lat_rad, lon_rad,
+        country, country_lat, country_lon, pop_est and continent columns
+    '''
+    if lat_distribution not in LAT_DISTRIBUTIONS:
+        raise ValueError('Invalid latitude distribution. Must be "normal", "uniform" or "bands".')
+    if population_distribution not in POPULATION_DISTRIBUTIONS:
+        raise ValueError('Invalid population distribution. Must be "lognormal" or "pareto".')
+
+    rng = np.random.default_rng(seed)
+
+    if lat_distribution == 'normal':
+        lats = rng.normal(lat_center, lat_spread, n)
+    elif lat_distribution == 'uniform':
+        lats = rng.uniform(lat_center - lat_spread, lat_center + lat_spread, n)
+    else:
+        centers = lat_center + 2 * lat_spread * rng.integers(-1, 2, n)
+        lats = rng.normal(centers, lat_spread / 4)
+    lats = np.round(np.clip(lats, -89.9, 89.9), 4)
+
+    lons = np.round(rng.uniform(-180, 180, n), 4)
+    n_duplicates = int(n * duplicate_lon_fraction)
+    lons[rng.choice(n, n_duplicates, replace=False)] = lons[rng.choice(n, n_duplicates)]
+
+    if population_distribution == 'lognormal':
+        populations = rng.lognormal(10, 1.5, n)
+    else:
+        populations = 5_000 * (1 + rng.pareto(1.2, n))
+    populations = np.round(populations)
+
+    # countries are longitude strips, the borders are random cut points
+    borders = np.sort(rng.uniform(-180, 180, n_countries - 1))
+    country_ids = np.searchsorted(borders, lons)
+    codes = np.array([f'C{i:02d}' for i in range(n_countries)])
+    names = np.array([f'Country {i}' for i in range(n_countries)])
+    edges = np.r_[-180, borders, 180]
+
+    loc_df = pd.DataFrame({
+        'code': codes[country_ids],
+        'city': [f'city{i}' for i in range(n)],
+        'accent_city': [f'City {i}' for i in range(n)],
+        'population': populations,
+        'lat': lats,
+        'lon': lons,
+    })
+    loc_df.sort_values('population', ascending=False, inplace=True)
+    loc_df.drop_duplicates(subset=['lat', 'lon'], keep='first', inplace=True)
+    loc_df['lat_rad'] = np.radians(loc_df['lat'])
+    loc_df['lon_rad'] = np.radians(loc_df['lon'])
+
+    ids = np.searchsorted(borders, loc_df['lon'].values)
+    loc_df['country'] = names[ids]
+    loc_df['country_lat'] = lat_center
+    loc_df['country_lon'] = ((edges[:-1] + edges[1:]) / 2)[ids]
+    loc_df['pop_est'] = loc_df.groupby('code')['population'].transform('sum') * 10
+    loc_df['continent'] = 'Synthetica'
+    return loc_df.reset_index(drop=True)
+
+def largest_city(loc_df):
+    '''(city, code) of the most populous city, a convenient journey origin.'''
+    row = loc_df.loc[loc_df['population'].idxmax()]
+    return row['city'], row['code']
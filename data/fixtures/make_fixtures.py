@@ -0,0 +1,94 @@
+'''
+Builds the small offline fixture used instead of the real sources:
+    cities.csv           MaxMind world cities format, real major cities plus seeded random towns
+    countries.geo.json   country borders, in the format of johan/world.geo.json
+    world.geojson        naturalearth countries (pop_est, continent, name, iso_a3, gdp_md_est)
+Countries are taken from naturalearth_lowres around the 45°N - 56°N band and simplified to keep the files small.
+
+Usage (from the repository root):
+    python data/fixtures/make_fixtures.py
+'''
+import json
+import os
+import warnings
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+
+FIXTURE_DIR = os.path.dirname(os.path.abspath(__file__))
+LAT_RANGE = (45, 56)
+N_TOWNS = 3000
+SEED = 42
+
+warnings.filterwarnings('ignore')
+
+MAJOR_CITIES = [
+    # country, city, accent city, latitude, longitude, population
+    ('gb', 'london', 'London', 51.514125, -0.093689, 7421228),
+    ('gb', 'birmingham', 'Birmingham', 52.466667, -1.916667, 984333),
+    ('nl', 'amsterdam', 'Amsterdam', 52.35, 4.916667, 745811),
+    ('de', 'berlin', 'Berlin', 52.516667, 13.4, 3398362),
+    ('de', 'hamburg', 'Hamburg', 53.55, 10.0, 1733846),
+    ('pl', 'warsaw', 'Warsaw', 52.25, 21.0, 1702154),
+    ('ua', 'kiev', 'Kiev', 50.433333, 30.516667, 2514227),
+    ('ru', 'moscow', 'Moscow', 55.752222, 37.615556, 10381288),
+    ('kz', 'astana', 'Astana', 51.166667, 71.433333, 345604),
+    ('ru', 'novosibirsk', 'Novosibirsk', 55.041111, 82.934444, 1419016),
+    ('mn', 'ulaanbaatar', 'Ulaanbaatar', 47.916667, 106.916667, 844818),
+    ('cn', 'harbin', 'Harbin', 45.75, 126.65, 3229883),
+    ('ca', 'vancouver', 'Vancouver', 49.25, -123.133333, 1837970),
+    ('ca', 'winnipeg', 'Winnipeg', 49.883333, -97.166667, 632069),
+    ('ca', 'montreal', 'Montreal', 45.5, -73.583333, 3268513),
+]
+
+def make_world():
+    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+    band = box(-180, LAT_RANGE[0], 180, LAT_RANGE[1])
+    world = world.loc[world.intersects(band)].copy()
+    world['geometry'] = world.simplify(0.1)
+    return world.reset_index(drop=True)
+
+def make_cities(world):
+    rng = np.random.default_rng(SEED)
+    band = box(-180, LAT_RANGE[0], 180, LAT_RANGE[1])
+    areas = world.intersection(band)
+    codes = ['gb', 'nl', 'de', 'pl', 'ua', 'ru', 'kz', 'mn', 'cn', 'ca', 'us', 'fr', 'by', 'cz', 'at', 'hu', 'ro', 'ie']
+    iso2 = dict(zip(['GBR', 'NLD', 'DEU', 'POL', 'UKR', 'RUS', 'KAZ', 'MNG', 'CHN', 'CAN', 'USA', 'FRA', 'BLR', 'CZE', 'AUT', 'HUN', 'ROU', 'IRL'], codes))
+
+    rows = [dict(zip(['Country', 'City', 'AccentCity', 'Latitude', 'Longitude', 'Population'], city)) for city in MAJOR_CITIES]
+    candidates = world.loc[world['iso_a3'].isin(iso2)].index
+    weights = areas.loc[candidates].area.values
+    for i in range(N_TOWNS):
+        country = rng.choice(candidates, p=weights / weights.sum())
+        min_lon, min_lat, max_lon, max_lat = areas.loc[country].bounds
+        while True:
+            lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+            if areas.loc[country].contains(gpd.points_from_xy([lon], [lat])[0]):
+                break
+        population = round(rng.lognormal(9.5, 1.3)) if rng.random() > 0.1 else np.nan  # some towns without population
+        rows.append({'Country': iso2[world.loc[country, 'iso_a3']], 'City': f'town {i}', 'AccentCity': f'Town {i}',
+                     'Latitude': round(lat, 7), 'Longitude': round(lon, 7), 'Population': population})
+    cities = pd.DataFrame(rows)
+    cities['Region'] = rng.integers(1, 30, len(cities))
+    cities = pd.concat([cities, cities.iloc[[20, 30]].assign(Population=np.nan)])  # duplicated coordinates
+    return cities[['Country', 'City', 'AccentCity', 'Region', 'Population', 'Latitude', 'Longitude']]
+
+def main():
+    world = make_world()
+    world.to_file(os.path.join(FIXTURE_DIR, 'world.geojson'), driver='GeoJSON')
+
+    features = json.loads(world[['name', 'iso_a3', 'geometry']].to_json())['features']
+    countries = {'type': 'FeatureCollection',
+                 'features': [{'type': 'Feature',
+                               'id': feature['properties']['iso_a3'],
+                               'properties': {'name': feature['properties']['name']},
+                               'geometry': feature['geometry']} for feature in features]}
+    with open(os.path.join(FIXTURE_DIR, 'countries.geo.json'), 'w') as file:
+        json.dump(countries, file)
+
+    make_cities(world).to_csv(os.path.join(FIXTURE_DIR, 'cities.csv'), index=False)
+
+if __name__ == '__main__':
+    main()
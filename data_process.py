@@ -1,67 +1,328 @@
+import argparse
+import hashlib
 import json
 import os
 import requests
 import tempfile
 
-import country_converter as coco
 import glob
-import geopandas as gpd
-from kaggle.api.kaggle_api_extended import KaggleApi
 import numpy as np
 import pandas as pd
-from shapely.geometry import shape
+import pyarrow
+import shapely
 
-def download_and_process_data():
-    dataset = 'max-mind/world-cities-database'
-    country_url = 'https://raw.githubusercontent.com/johan/world.geo.json/master/countries.geo.json'
+import profiling
 
-    os.environ['KAGGLE_USERNAME'] = os.getenv('KAGGLE_USERNAME')
-    os.environ['KAGGLE_KEY'] = os.getenv('KAGGLE_KEY')
+CACHE_DIR = os.getenv('AROUND_THE_WORLD_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data_cache'))
+CACHE_VERSION = 1
+CITIES_DATASET = 'max-mind/world-cities-database'
+COUNTRIES_URL = 'https://raw.githubusercontent.com/johan/world.geo.json/master/countries.geo.json'
 
-    api = KaggleApi()
-    api.authenticate()
+class KaggleFetcher:
+    '''Downloads the cities CSV from Kaggle. Needs the KAGGLE_USERNAME and KAGGLE_KEY environment variables.'''
+    def __init__(self, dataset=CITIES_DATASET):
+        self.dataset = dataset
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        api.dataset_download_files(dataset, path=temp_dir, unzip=True)
+    def fetch(self, directory):
+        # kaggle authenticates on import, only needed when downloading
+        from kaggle.api.kaggle_api_extended import KaggleApi
+
+        os.environ['KAGGLE_USERNAME'] = os.getenv('KAGGLE_USERNAME')
+        os.environ['KAGGLE_KEY'] = os.getenv('KAGGLE_KEY')
+
+        api = KaggleApi()
+        api.authenticate()
+        api.dataset_download_files(self.dataset, path=directory, unzip=True)
 
         try:
-            data = pd.read_csv(glob.glob(f'{temp_dir}/*.csv')[0])
+            return glob.glob(f'{directory}/*.csv')[0]
         except IndexError:
             raise FileNotFoundError('No CSV file found in the temporary directory.')
 
-        loc_df = data.copy()
-        loc_df.columns = [col.lower() for col in loc_df.columns]
-        loc_df.rename(columns={'country': 'code', 
-                               'accentcity': 'accent_city', 
-                               'latitude': 'lat', 
-                               'longitude': 'lon'}, inplace=True)
-        loc_df.sort_values('population', ascending=False, inplace=True)
-        loc_df.drop_duplicates(subset=['lat', 'lon'], keep='first', inplace=True)
-        loc_df['lat_rad'] = np.radians(loc_df['lat'])
-        loc_df['lon_rad'] = np.radians(loc_df['lon'])
-        loc_df['code'] = loc_df['code'].apply(lambda x: x.upper())
-        loc_df.dropna(subset=['population'], inplace=True)
-
-        geojson_data = requests.get(country_url).json()
-        country_df = pd.DataFrame()
-
-        for index, feature in enumerate(geojson_data['features']):
-            geometry = shape(feature['geometry'])
-            centroid = geometry.centroid
-            country_df.loc[index, 'country'] = feature['properties']['name']
-            country_df.loc[index, 'country_lat'] = centroid.y
-            country_df.loc[index, 'country_lon'] = centroid.x
-
-        country_df['code'] = coco.convert(names=country_df['country'], to='ISO2')
-
-        world_gdf = gpd.datasets.get_path('naturalearth_lowres')
-        world_gdf = gpd.read_file(world_gdf)
-        world_gdf['code'] = coco.convert(names=world_gdf['iso_a3'], to='ISO2')
-        country_df = pd.merge(country_df, 
-                              world_gdf.drop(['name', 'iso_a3', 'gdp_md_est'], axis=1).query('code != "not found"'), 
-                              on='code')
-
-        loc_df = pd.merge(loc_df, country_df, on='code')
-        loc_df.drop(columns=['region'], inplace=True)
-
-    return loc_df, country_df, geojson_data
\ No newline at end of file
+class HTTPFetcher:
+    '''Downloads a file from a URL.'''
+    def __init__(self, url, file_name):
+        self.url = url
+        self.file_name = file_name
+
+    def fetch(self, directory):
+        response = requests.get(self.url)
+        response.raise_for_status()
+        path = os.path.join(directory, self.file_name)
+        with open(path, 'wb') as file:
+            file.write(response.content)
+        return path
+
+class LocalFetcher:
+    '''Uses a file that is already on disk, for offline runs.'''
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, directory):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f'{self.path} not found.')
+        return self.path
+
+@profiling.timed('download_and_process_data')
+def download_and_process_data(cache_dir=CACHE_DIR, refresh=False, cities_fetcher=None, countries_fetcher=None, world_fetcher=None,
+                              compact=False):
+    '''
+    Fetches and processes the cities and countries data.
+    By default the cities come from Kaggle, the country borders from GitHub and the country details from naturalearth.
+    Pass fetchers (e.g. LocalFetcher) to use other sources, such as local files without any network.
+    The processed data is cached in `cache_dir`, keyed by the hash of the source files,
+    so the next runs load it from disk without any download or processing.
+    refresh=True fetches the sources again and only reprocesses them if they changed,
+    sources are always fetched when fetchers are passed. cache_dir=None disables the cache.
+    compact=True returns the city table of `compact_location_data`.
+    '''
+    loc_df, country_df, geojson_data = _load_or_process_data(cache_dir, refresh, cities_fetcher, countries_fetcher,
+                                                             world_fetcher)
+    if compact:
+        loc_df = compact_location_data(loc_df)
+    return loc_df, country_df, geojson_data
+
+def _load_or_process_data(cache_dir, refresh, cities_fetcher, countries_fetcher, world_fetcher):
+    custom_sources = any(fetcher is not None for fetcher in (cities_fetcher, countries_fetcher, world_fetcher))
+    if cache_dir and not refresh and not custom_sources:
+        cached = load_cached_data(cache_dir)
+        if cached is not None:
+            return cached
+
+    cities_fetcher = cities_fetcher or KaggleFetcher()
+    countries_fetcher = countries_fetcher or HTTPFetcher(COUNTRIES_URL, 'countries.geo.json')
+    if world_fetcher is None:
+        import geopandas as gpd
+        world_fetcher = LocalFetcher(gpd.datasets.get_path('naturalearth_lowres'))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cities_path = cities_fetcher.fetch(temp_dir)
+        countries_path = countries_fetcher.fetch(temp_dir)
+        world_path = world_fetcher.fetch(temp_dir)
+
+        source_hash = hash_sources(cities_path, countries_path, world_path)
+        if cache_dir:
+            cached = load_cached_data(cache_dir, source_hash)
+            if cached is not None:
+                return cached
+
+        loc_df, country_df, geojson_data = process_data(cities_path, countries_path, world_path, cache_dir)
+
+    if cache_dir:
+        save_cached_data(cache_dir, source_hash, loc_df, country_df, geojson_data)
+
+    return loc_df, country_df, geojson_data
+
+@profiling.timed('process_data')
+def process_data(cities, countries, world=None, cache_dir=None):
+    '''
+    Processes the raw sources into the city and country tables.
+    Input:
+        cities: path or file-like object of the MaxMind world cities CSV
+        countries: path, file-like object or loaded dict of the countries GeoJSON
+        world: path or file-like object of the naturalearth countries (naturalearth_lowres by default)
+        cache_dir: where the converted country codes are memoized, None (default) to write nothing on disk
+    Output:
+        loc_df, country_df, geojson_data
+    '''
+    import geopandas as gpd
+
+    data = pd.read_csv(cities)
+
+    loc_df = data.copy()
+    loc_df.columns = [col.lower() for col in loc_df.columns]
+    loc_df.rename(columns={'country': 'code', 
+                           'accentcity': 'accent_city', 
+                           'latitude': 'lat', 
+                           'longitude': 'lon'}, inplace=True)
+    loc_df.sort_values('population', ascending=False, inplace=True)
+    loc_df.drop_duplicates(subset=['lat', 'lon'], keep='first', inplace=True)
+    loc_df['lat_rad'] = np.radians(loc_df['lat'])
+    loc_df['lon_rad'] = np.radians(loc_df['lon'])
+    loc_df['code'] = loc_df['code'].apply(lambda x: x.upper())
+    loc_df.dropna(subset=['population'], inplace=True)
+
+    if isinstance(countries, dict):
+        geojson_data = countries
+    elif hasattr(countries, 'read'):
+        geojson_data = json.load(countries)
+    else:
+        with open(countries) as file:
+            geojson_data = json.load(file)
+    features = gpd.GeoDataFrame.from_features(geojson_data['features'])
+    centroids = features.geometry.centroid
+    country_df = pd.DataFrame({'country': features['name'].values,
+                               'country_lat': centroids.y.values,
+                               'country_lon': centroids.x.values})
+
+    country_df['code'] = convert_country_codes(country_df['country'], cache_dir=cache_dir)
+
+    world_gdf = gpd.read_file(world or gpd.datasets.get_path('naturalearth_lowres'))
+    world_gdf['code'] = convert_country_codes(world_gdf['iso_a3'], cache_dir=cache_dir)
+    country_df = pd.merge(country_df, 
+                          world_gdf.drop(['name', 'iso_a3', 'gdp_md_est'], axis=1).query('code != "not found"'), 
+                          on='code')
+
+    loc_df = pd.merge(loc_df, country_df, on='code')
+    loc_df.drop(columns=['region'], inplace=True)
+    profiling.count('rows_processed', len(data))
+
+    return loc_df, country_df, geojson_data
+
+def compact_location_data(loc_df):
+    '''
+    Compact copy of the city table, to cut memory and speed up copies and filters.
+    The country geometry is dropped (it is in the country table, referenced by code),
+    repeated strings become categorical, populations integers and the country centroids float32.
+    The city coordinates stay float64 since the paths depend on their exact order and distances.
+    '''
+    loc_df = loc_df.drop(columns=['geometry'], errors='ignore')
+    for col in ['code', 'country', 'continent']:
+        if col in loc_df:
+            loc_df[col] = loc_df[col].astype('category')
+    for col in ['population', 'pop_est']:
+        if col in loc_df and loc_df[col].notna().all():
+            loc_df[col] = pd.to_numeric(loc_df[col].astype('int64'), downcast='integer')
+    for col in ['country_lat', 'country_lon']:
+        if col in loc_df:
+            loc_df[col] = loc_df[col].astype('float32')
+    return loc_df
+
+def convert_country_codes(names, to='ISO2', cache_dir=None):
+    '''
+    Converts country names or codes with country_converter, once for all the unique values.
+    Conversions are memoized in `cache_dir` for the installed country_converter version, so they are not
+    repeated across runs and are converted again when it is upgraded. cache_dir=None disables the memo.
+    '''
+    import country_converter as coco
+
+    memo_path = os.path.join(cache_dir, 'country_codes.json') if cache_dir else None
+    version = getattr(coco, '__version__', None)
+    country_codes = {}
+    if memo_path and os.path.exists(memo_path):
+        with open(memo_path) as file:
+            memo = json.load(file)
+        if 'codes' in memo and memo.get('version') == version:
+            country_codes = memo['codes']
+
+    keys = [f'{to}:{name}' for name in names]
+    missing = sorted({name for name, key in zip(names, keys) if key not in country_codes})
+    if missing:
+        converted = coco.convert(names=missing, to=to)
+        if len(missing) == 1:
+            converted = [converted]
+        country_codes.update({f'{to}:{name}': code for name, code in zip(missing, converted)})
+        if memo_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(memo_path, 'w') as file:
+                json.dump({'version': version, 'codes': country_codes}, file)
+
+    return [country_codes[key] for key in keys]
+
+def hash_sources(*sources):
+    '''SHA-256 of the source files (paths) or contents (bytes), in order.'''
+    digest = hashlib.sha256()
+    for source in sources:
+        if isinstance(source, bytes):
+            digest.update(source)
+            continue
+        with open(source, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_manifest(cache_dir):
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return {'version': CACHE_VERSION, 'latest': None, 'entries': {}}
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    if manifest.get('version') != CACHE_VERSION:
+        return {'version': CACHE_VERSION, 'latest': None, 'entries': {}}
+    return manifest
+
+def _write_manifest(cache_dir, manifest):
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    with open(f'{manifest_path}.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+def load_cached_data(cache_dir=CACHE_DIR, source_hash=None):
+    '''
+    Loads the processed data of `source_hash` (the latest one by default) from the cache.
+    Returns None if it is not cached.
+    '''
+    manifest = _read_manifest(cache_dir)
+    source_hash = source_hash or manifest['latest']
+    if source_hash not in manifest['entries']:
+        return None
+
+    entry_dir = os.path.join(cache_dir, source_hash)
+    try:
+        loc_df = pd.read_parquet(os.path.join(entry_dir, 'loc_df.parquet'))
+        country_df = pd.read_parquet(os.path.join(entry_dir, 'country_df.parquet'))
+        geometries = pd.read_parquet(os.path.join(entry_dir, 'geometries.parquet'))
+        with open(os.path.join(entry_dir, 'countries.geo.json')) as file:
+            geojson_data = json.load(file)
+    except (OSError, pyarrow.ArrowInvalid):
+        # missing or corrupt entry, processed again from the sources
+        return None
+
+    import geopandas as gpd
+
+    entry = manifest['entries'][source_hash]
+    geometries = shapely.from_wkb(geometries['wkb'].values)
+    country_df['geometry'] = gpd.array.from_shapely(geometries[country_df.pop('geometry_id').values], crs=entry['crs'])
+    loc_df['geometry'] = gpd.array.from_shapely(geometries[loc_df.pop('geometry_id').values], crs=entry['crs'])
+    country_df = country_df[entry['country_columns']]
+    loc_df = loc_df[entry['loc_columns']]
+
+    if manifest['latest'] != source_hash:
+        manifest['latest'] = source_hash
+        _write_manifest(cache_dir, manifest)
+
+    return loc_df, country_df, geojson_data
+
+def save_cached_data(cache_dir, source_hash, loc_df, country_df, geojson_data):
+    '''Saves the processed data in the cache as Parquet files and marks it as the latest.'''
+    entry_dir = os.path.join(cache_dir, source_hash)
+    os.makedirs(entry_dir, exist_ok=True)
+
+    # geometries are repeated in the rows of a country after the merge, each distinct one is stored once
+    all_geometries = pd.concat([country_df['geometry'], loc_df['geometry']]).values
+    geometry_ids, unique_wkbs = pd.factorize(shapely.to_wkb(np.asarray(all_geometries)), use_na_sentinel=False)
+    pd.DataFrame({'wkb': unique_wkbs}).to_parquet(os.path.join(entry_dir, 'geometries.parquet'))
+
+    country_df.drop(columns=['geometry']).assign(geometry_id=geometry_ids[:len(country_df)]).to_parquet(
+        os.path.join(entry_dir, 'country_df.parquet'))
+    loc_df.drop(columns=['geometry']).assign(geometry_id=geometry_ids[len(country_df):]).to_parquet(
+        os.path.join(entry_dir, 'loc_df.parquet'))
+    with open(os.path.join(entry_dir, 'countries.geo.json'), 'w') as file:
+        json.dump(geojson_data, file)
+
+    crs = getattr(country_df['geometry'].values, 'crs', None)
+    manifest = _read_manifest(cache_dir)
+    manifest['entries'][source_hash] = {
+        'loc_columns': list(loc_df.columns),
+        'country_columns': list(country_df.columns),
+        'crs': crs.to_string() if crs else None,
+    }
+    manifest['latest'] = source_hash
+    _write_manifest(cache_dir, manifest)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetches, processes and caches the data.')
+    parser.add_argument('--refresh', action='store_true', help='Fetch the sources again even if the data is cached.')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--cities', help='Local cities CSV instead of the Kaggle dataset.')
+    parser.add_argument('--countries', help='Local countries GeoJSON instead of the GitHub one.')
+    parser.add_argument('--world', help='Local naturalearth countries file.')
+    args = parser.parse_args()
+
+    location_df, country_df, _ = download_and_process_data(
+        cache_dir=args.cache_dir,
+        refresh=args.refresh,
+        cities_fetcher=LocalFetcher(args.cities) if args.cities else None,
+        countries_fetcher=LocalFetcher(args.countries) if args.countries else None,
+        world_fetcher=LocalFetcher(args.world) if args.world else None)
+    print(f'{len(location_df):,} cities and {len(country_df):,} countries cached in {args.cache_dir}')
@@ -0,0 +1,138 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import profiling
+from utils import LatitudeBandIndex
+
+ARTIFACT_VERSION = 1
+ARRAYS = ['lats', 'order', 'band_starts', 'band_stops', 'lon_ranks_E', 'lon_ranks_W']
+
+class RoutingArtifact(LatitudeBandIndex):
+    """
+    Routing structures of the whole city table, built once and reused for every journey.
+    Holds the latitude order, the latitude band of every city and the rank of every longitude
+    in the custom east/west order of `PathExplorer`, so a journey's explorable path is a slice
+    instead of a new search and sort. It is saved as a versioned directory of .npy files
+    that is memory-mapped when loaded.
+    """
+    def __init__(self, arrays, lat_boundry, fingerprint=None):
+        self.lat_boundry = lat_boundry
+        self.fingerprint = fingerprint
+        self.lats = arrays['lats']
+        self.order = arrays['order']
+        self.band_starts = arrays['band_starts']
+        self.band_stops = arrays['band_stops']
+        self.lon_ranks = {'E': arrays['lon_ranks_E'], 'W': arrays['lon_ranks_W']}
+
+    @classmethod
+    @profiling.timed('RoutingArtifact.build')
+    def build(cls, points, lat_boundry=2):
+        """
+        Builds the artifact from (lat, lon) points in degrees, in the order of the city table.
+        """
+        points = np.asarray(points, dtype=float)
+        band_index = LatitudeBandIndex(points, lat_boundry)
+        band_starts, band_stops = band_index.bounds(np.arange(len(points)))
+        arrays = {
+            'lats': band_index.lats,
+            'order': band_index.order,
+            'band_starts': band_starts,
+            'band_stops': band_stops,
+            'lon_ranks_E': cls._longitude_ranks(points[:, 1], 'E'),
+            'lon_ranks_W': cls._longitude_ranks(points[:, 1], 'W'),
+        }
+        return cls(arrays, lat_boundry, cls.points_fingerprint(points))
+
+    @staticmethod
+    def _longitude_ranks(longitudes, moving_direction):
+        """
+        Dense rank of each longitude in the custom order of `PathExplorer._sort_longitudes`:
+        zero first, then the positive and the negative longitudes, ascending to the east and descending to the west.
+        """
+        if moving_direction == 'E':
+            groups = np.where(longitudes == 0, 0, np.where(longitudes > 0, 1, 2))
+            keys = longitudes
+        else:
+            groups = np.where(longitudes == 0, 0, np.where(longitudes < 0, 1, 2))
+            keys = -longitudes
+        keys = np.where(longitudes == 0, 0, keys)  # -0.0 and 0.0 are the same longitude
+        order = np.lexsort((keys, groups))
+        ranks = np.empty(len(longitudes), dtype=np.int64)
+        ranks[order] = np.concatenate(([0], np.cumsum(np.diff(keys[order]) != 0)))
+        return ranks
+
+    @staticmethod
+    def points_fingerprint(points):
+        '''SHA-256 of the points, to check that an artifact belongs to a city table.'''
+        return hashlib.sha256(np.ascontiguousarray(points, dtype=float).tobytes()).hexdigest()
+
+    def check_points(self, points):
+        """Raises ValueError if the artifact was not built from these (lat, lon) points."""
+        if len(points) != len(self) or self.points_fingerprint(points) != self.fingerprint:
+            raise ValueError('Invalid routing artifact. Must be built from the same city table.')
+
+    def bounds(self, idxs):
+        """Start and stop of the precomputed band(s) in the latitude-sorted order."""
+        return self.band_starts[idxs], self.band_stops[idxs]
+
+    def query_path(self, idx, moving_direction):
+        """
+        Band members of a point and their longitude order for `moving_direction`.
+        Returns the positional indices in their original order and the `lon_order` of each,
+        the same values `PathExplorer._sort_longitudes` assigns.
+        """
+        band = self.query(idx)
+        ranks = self.lon_ranks[moving_direction][band]
+        # as in the mapping of _sort_longitudes, repeated longitudes take the position of their last occurrence
+        lon_order = np.searchsorted(np.sort(ranks), ranks, side='right') - 1
+        return band, lon_order
+
+    def save(self, directory):
+        """Saves the arrays and a manifest in `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        arrays = {'lats': self.lats, 'order': self.order, 'band_starts': self.band_starts,
+                  'band_stops': self.band_stops, 'lon_ranks_E': self.lon_ranks['E'], 'lon_ranks_W': self.lon_ranks['W']}
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), np.asarray(arrays[name]))
+        manifest = {
+            'version': ARTIFACT_VERSION,
+            'lat_boundry': self.lat_boundry,
+            'n_points': len(self),
+            'fingerprint': self.fingerprint,
+            'arrays': ARRAYS,
+        }
+        with open(os.path.join(directory, 'manifest.json'), 'w') as file:
+            json.dump(manifest, file, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r', points=None):
+        """
+        Loads an artifact saved with `save`, memory-mapping the arrays by default.
+        Raises ValueError if it was built by another version, or from other points than `points` when they are given.
+        """
+        with open(os.path.join(directory, 'manifest.json')) as file:
+            manifest = json.load(file)
+        if manifest.get('version') != ARTIFACT_VERSION:
+            raise ValueError(f'Invalid artifact version. Must be {ARTIFACT_VERSION}, rebuild the artifact.')
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS}
+        artifact = cls(arrays, manifest['lat_boundry'], manifest['fingerprint'])
+        if points is not None:
+            artifact.check_points(points)
+        return artifact
+
+if __name__ == '__main__':
+    from data_process import download_and_process_data
+
+    parser = argparse.ArgumentParser(description='Builds the routing artifact of the cached city table.')
+    parser.add_argument('--out', required=True, help='Directory of the artifact.')
+    parser.add_argument('--lat-boundary', type=float, default=0.5)
+    args = parser.parse_args()
+
+    location_df, _, _ = download_and_process_data()
+    artifact = RoutingArtifact.build(location_df[['lat', 'lon']].values, lat_boundry=args.lat_boundary)
+    artifact.save(args.out)
+    print(f'Routing artifact of {len(artifact):,} cities saved in {args.out}')
@@ -0,0 +1,245 @@
+'''
+Computes the journeys of many origins in parallel, e.g. a leaderboard of every city over 1M population.
+The city table is placed once in shared memory and every worker process reads it from there,
+the routing artifact is built once and every worker memory-maps it.
+The summary of each journey is streamed to a CSV or Parquet file as soon as it finishes.
+
+Usage (from the repository root):
+    python -m path.batch --min-population 1000000 --directions E W --out leaderboard.csv
+    python -m path.batch --journeys journeys.csv --out leaderboard.parquet
+    python -m path.batch --artifact artifact/ --out leaderboard.csv
+'''
+import argparse
+import contextlib
+import csv
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from path.artifact import RoutingArtifact
+from path.explorer import PathExplorer
+from path.finder import path_finder
+from path.optimizer import CSRGraph
+
+TABLE_COLUMNS = ['code', 'city', 'population', 'lat', 'lon', 'lat_rad', 'lon_rad', 'country']
+SUMMARY_COLUMNS = ['city', 'country', 'direction', 'status', 'days', 'hours', 'km', 'cities', 'countries', 'seconds']
+
+class SharedCityTable:
+    '''
+    Read-only city table in a single shared memory block.
+    Numeric columns are stored as they are and text columns as categorical codes,
+    the categories themselves are small and sent to each worker once.
+    '''
+    def __init__(self, data, columns=TABLE_COLUMNS):
+        arrays = {'__index__': np.asarray(data.index)}
+        self.categories = {}
+        for col in columns:
+            values = data[col]
+            if pd.api.types.is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+                arrays[col] = np.ascontiguousarray(values.values)
+            else:
+                codes, categories = pd.factorize(values.astype(str))
+                arrays[col] = codes.astype(np.int32)
+                self.categories[col] = list(categories)
+
+        self.layout = []
+        offset = 0
+        for col, array in arrays.items():
+            self.layout.append((col, array.dtype.str, offset, len(array)))
+            offset += array.nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (col, _, start, _), array in zip(self.layout, arrays.values()):
+            self.shm.buf[start:start + array.nbytes] = array.tobytes()
+
+    @property
+    def spec(self):
+        '''What a worker needs to attach to the table.'''
+        return {'name': self.shm.name, 'layout': self.layout, 'categories': self.categories}
+
+    @staticmethod
+    def attach(spec):
+        '''Returns the shared memory block and the dataframe of the table, its numeric columns are views of the block.'''
+        shm = shared_memory.SharedMemory(name=spec['name'])
+        columns = {}
+        for col, dtype, start, length in spec['layout']:
+            array = np.ndarray(length, dtype=np.dtype(dtype), buffer=shm.buf, offset=start)
+            if col in spec['categories']:
+                array = pd.Categorical.from_codes(array, categories=spec['categories'][col])
+            columns[col] = array
+        index = columns.pop('__index__')
+        return shm, pd.DataFrame(columns, index=index, copy=False)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+_worker = {}
+
+def _init_worker(spec, artifact_dir, params):
+    shm, data = SharedCityTable.attach(spec)
+    _worker['shm'] = shm  # the block must stay open while the dataframe uses it
+    _worker['data'] = data
+    _worker['artifact'] = RoutingArtifact.load(artifact_dir, mmap_mode='r', points=data[['lat', 'lon']].values)
+    _worker['params'] = params
+
+def _solve_in_worker(journey):
+    return solve_journey(_worker['data'], _worker['artifact'], *journey, **_worker['params'])
+
+def solve_journey(data, artifact, city, country, direction, neighbors_times=[2,4,8], add_hours_country=2,
+                  add_hours_population=2, population_limit=200_000):
+    '''
+    Runs the pipeline of a single journey and returns its summary.
+    status is "ok", "incomplete" when the end is not reachable or the error message.
+    '''
+    summary = {'city': city, 'country': country, 'direction': direction, 'status': 'ok',
+               'days': None, 'hours': None, 'km': None, 'cities': None, 'countries': None}
+    started = time.perf_counter()
+    try:
+        explorable_path = PathExplorer(data,
+                                       origin_city=city,
+                                       origin_country=country,
+                                       moving_direction=direction,
+                                       neighbors_times=neighbors_times,
+                                       add_hours_country=add_hours_country,
+                                       add_hours_population=add_hours_population,
+                                       population_limit=population_limit)
+        explorable_path.prepare_explorable_path(artifact)
+        explorable_path.filter_path()
+        graph = CSRGraph.from_edges(explorable_path.edges, explorable_path.get_dataframe().index)
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = path_finder(explorable_path, graph)
+    except ValueError as error:
+        summary['status'] = str(error)
+        found = None
+    else:
+        if found is None:
+            summary['status'] = 'incomplete'
+
+    if found is not None:
+        result = found[2]
+        total_hours = result['normed_next_point_duration'].sum()
+        summary.update(days=int(total_hours // 24), hours=int(total_hours % 24),
+                       km=int(result['next_point_distance'].sum()), cities=len(result),
+                       countries=result['country'].nunique())
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+class SummaryWriter:
+    '''Appends the summaries to a CSV or Parquet file (by extension) as they come.'''
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        self._file = None
+        self._writer = None
+
+    def write(self, summary):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pylist([summary], schema=self._schema(pa))
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            if self._writer is None:
+                self._file = open(self.path, 'w', newline='')
+                self._writer = csv.DictWriter(self._file, fieldnames=SUMMARY_COLUMNS)
+                self._writer.writeheader()
+            self._writer.writerow(summary)
+            self._file.flush()
+
+    @staticmethod
+    def _schema(pa):
+        return pa.schema([('city', pa.string()), ('country', pa.string()), ('direction', pa.string()),
+                          ('status', pa.string()), ('days', pa.int64()), ('hours', pa.int64()), ('km', pa.int64()),
+                          ('cities', pa.int64()), ('countries', pa.int64()), ('seconds', pa.float64())])
+
+    def close(self):
+        if self.parquet and self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+def solve_journeys(data, journeys, output=None, workers=None, lat_boundry=0.5, artifact_dir=None, **params):
+    '''
+    Computes many journeys in parallel.
+    Input:
+        data: city table of `download_and_process_data`
+        journeys: list of (city, country code, direction) tuples
+        output: CSV or Parquet file where each summary is written when its journey finishes
+        workers: number of processes, os.cpu_count() by default
+        lat_boundry: latitude boundary of the paths
+        artifact_dir: routing artifact saved by `RoutingArtifact.save` for `data`, its own latitude boundary is used.
+            By default it is built with `lat_boundry` and saved in a temporary directory
+        params: neighbors_times, add_hours_country, add_hours_population and population_limit of `PathExplorer`
+    Output:
+        the summaries in the order they finished
+    '''
+    points = data[['lat', 'lon']].values
+    temp_dir = None
+    if artifact_dir is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        artifact_dir = temp_dir.name
+        RoutingArtifact.build(points, lat_boundry=lat_boundry).save(artifact_dir)
+    else:
+        RoutingArtifact.load(artifact_dir, points=points)
+
+    table = SharedCityTable(data)
+    writer = SummaryWriter(output) if output else None
+    summaries = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(table.spec, artifact_dir, params)) as executor:
+            futures = [executor.submit(_solve_in_worker, tuple(journey)) for journey in journeys]
+            for future in as_completed(futures):
+                summary = future.result()
+                summaries.append(summary)
+                if writer:
+                    writer.write(summary)
+                print(f'[{len(summaries)}/{len(futures)}] {summary["city"]}, {summary["country"]} '
+                      f'({summary["direction"]}): {summary["status"]}')
+    finally:
+        if writer:
+            writer.close()
+        table.close()
+        if temp_dir:
+            temp_dir.cleanup()
+    return summaries
+
+def main():
+    parser = argparse.ArgumentParser(description='Computes the journeys of many origins in parallel.')
+    parser.add_argument('--journeys', help='CSV with city, country (code) and direction columns.')
+    parser.add_argument('--min-population', type=int, default=1_000_000,
+                        help='Without --journeys, every city above this population is an origin.')
+    parser.add_argument('--directions', nargs='+', default=['E', 'W'], choices=['E', 'W'])
+    parser.add_argument('--out', required=True, help='.csv or .parquet output file.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--lat-boundary', type=float, default=0.5)
+    parser.add_argument('--artifact', help='Routing artifact saved by path.artifact, built for this run by default.')
+    args = parser.parse_args()
+
+    from data_process import download_and_process_data
+
+    location_df, _, _ = download_and_process_data(compact=True)
+    if args.journeys:
+        journeys = pd.read_csv(args.journeys)[['city', 'country', 'direction']].itertuples(index=False)
+    else:
+        origins = location_df.loc[location_df['population'] > args.min_population, ['city', 'code']]
+        journeys = [(city, code, direction) for city, code in origins.itertuples(index=False)
+                    for direction in args.directions]
+    journeys = [tuple(journey) for journey in journeys]
+
+    print(f'{len(journeys):,} journeys on {args.workers} workers')
+    solve_journeys(location_df, journeys, output=args.out, workers=args.workers, lat_boundry=args.lat_boundary,
+                   artifact_dir=args.artifact)
+    print(f'Summaries saved in {args.out}')
+
+if __name__ == '__main__':
+    main()
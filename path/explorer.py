@@ -1,4 +1,8 @@
+import numpy as np
+
+import profiling
 import utils
+from path.artifact import RoutingArtifact
 
 class PathExplorer:
     def __init__(self, data, 
@@ -8,9 +12,12 @@ class PathExplorer:
                  neighbors_times: list,
                  add_hours_country: int,
                  add_hours_population: int,
-                 population_limit: int):
+                 population_limit: int,
+                 neighbor_mode: str = 'degrees'):
         if moving_direction not in ['E', 'W']:
             raise ValueError('Invalid moving direction. Must be "E" (East) or "W" (West).')
+        if neighbor_mode not in ['degrees', 'sphere']:
+            raise ValueError('Invalid neighbor mode. Must be "degrees" or "sphere".')
         
         self.data = data
         self.origin_city = origin_city
@@ -20,12 +27,15 @@ class PathExplorer:
         self.add_hours_country = add_hours_country
         self.add_hours_population = add_hours_population
         self.population_limit = population_limit
+        self.neighbor_mode = neighbor_mode
+        self.duration_matrix = utils.build_duration_matrix(neighbors_times, add_hours_country, add_hours_population)
         self.origin_index = self._get_origin_index()
         self.explorable_path_df = None
         self.path_limit_thresh = 0.005  # Default path limit threshold
         self.neighbors = []
         self.times = []
         self.all_distances = []
+        self.edges = None
 
     def _get_origin_index(self):
         origin = self.data.query(f'city == "{self.origin_city}" and code == "{self.origin_country}"')
@@ -33,11 +43,24 @@ class PathExplorer:
             raise ValueError('Origin city not found in the dataset!')
         return origin.index[0]
 
+    @profiling.timed('prepare_explorable_path')
     def prepare_explorable_path(self, valid_neighbors):
         """
         Prepares a general path based on the origin point's all valid neighbors in the target direction. 
+        valid_neighbors: RoutingArtifact, LatitudeBandIndex or the boolean matrix of `utils.identify_valid_points`.
         """
-        self.explorable_path_df = self.data.loc[valid_neighbors[self.origin_index]].reset_index(drop=True)
+        if isinstance(valid_neighbors, RoutingArtifact):
+            valid_neighbors.check_points(self.data[['lat', 'lon']].values)
+            band, lon_order = valid_neighbors.query_path(self.data.index.get_loc(self.origin_index), self.moving_direction)
+            self.explorable_path_df = self.data.iloc[band].reset_index(drop=True)
+            self.explorable_path_df['lon_order'] = lon_order
+            self.explorable_path_df = self.explorable_path_df.iloc[np.argsort(lon_order, kind='quicksort')]
+            return
+        if isinstance(valid_neighbors, utils.LatitudeBandIndex):
+            band = valid_neighbors.query(self.data.index.get_loc(self.origin_index))
+            self.explorable_path_df = self.data.iloc[band].reset_index(drop=True)
+        else:
+            self.explorable_path_df = self.data.loc[valid_neighbors[self.origin_index]].reset_index(drop=True)
         self._sort_longitudes()
 
     def _sort_longitudes(self):
@@ -59,18 +82,42 @@ class PathExplorer:
         self.explorable_path_df['lon_order'] = self.explorable_path_df['lon'].map(lon_order_mapping)
         self.explorable_path_df.sort_values('lon_order', inplace=True)
 
-    def filter_path(self):
+    @profiling.timed('filter_path')
+    def filter_path(self, engine='vectorized', progress=None):
         """
         Filters a number of points based on the percentile of custom-sorted longitudes for each point,
         sets the limit of the percentile to get close points,
         and finally finds the valid #n closests neghbors (adjacent list) and time/distance needed to travel to each point (edges).
+        engine: "vectorized" computes every row's longitude window at once, "iterative" re-ranks a copy of the path for each row.
+        progress: optional callback, called with (rows processed, total rows) as the rows are processed.
+                  The vectorized engine reports its stages: the windows, the closest points by chunks of rows and the edges.
         """
+        if engine not in ['vectorized', 'iterative']:
+            raise ValueError('Invalid engine. Must be "vectorized" or "iterative".')
 
         self.neighbors = []
         self.times = []
         self.all_distances = []
-        
-        for _, row in self.explorable_path_df.iterrows():
+        profiling.count('explorable_path_rows', len(self.explorable_path_df))
+
+        n_rows = len(self.explorable_path_df)
+        if progress:
+            progress(0, n_rows)
+        if engine == 'vectorized':
+            self._filter_path_vectorized(progress)
+        else:
+            self._filter_path_iterative(progress)
+            self.edges = self._edges_from_lists()
+        if progress:
+            progress(n_rows, n_rows)
+
+        self.explorable_path_df['adjacency_list'] = self.neighbors
+        self.explorable_path_df['time_edges'] = self.times
+        self.explorable_path_df['distance_edges'] = self.all_distances
+
+    def _filter_path_iterative(self, progress=None):
+        n_rows = len(self.explorable_path_df)
+        for row_number, (_, row) in enumerate(self.explorable_path_df.iterrows()):
             path_df = self.explorable_path_df.copy()
 
             # shift longitudes and calculate rankings
@@ -84,10 +131,189 @@ class PathExplorer:
             # find neighbors and calculate time for each path
             current_point_country = row['country']
             self._find_neighbors_and_calculate_time(row, filtered_path_df, current_point_country)
+            if progress and row_number + 1 < n_rows:
+                progress(row_number + 1, n_rows)
 
-        self.explorable_path_df['adjacency_list'] = self.neighbors
+    def _filter_path_vectorized(self, progress=None):
+        """
+        Same result as the iterative engine without copying the path for each row.
+        Every row's window is a circular slice of the custom-sorted longitudes starting at the row's own longitude,
+        so it is described by an offset into the `lon_order` sorted array and a window size.
+        The closest points of all the windows are then found with a single KD-tree built over the whole path.
+        """
+        path_df = self.explorable_path_df
+        lons = path_df['lon'].values
+        n_points = len(lons)
+        if n_points < 20:
+            raise ValueError('Not enough points in the explorable path! At least 20 points are needed.')
+
+        def report(share):
+            """Progress of the stages, as the share of the rows they stand for."""
+            if progress:
+                progress(int(n_points * share), n_points)
+
+        # equal longitudes share their ranking, so the windows are built from groups of equal longitudes
+        group_starts = np.flatnonzero(np.r_[True, lons[1:] != lons[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, n_points])
+        group_ids = np.repeat(np.arange(len(group_starts)), group_sizes)
+
+        window_starts = group_starts[group_ids]
+        window_sizes = self._find_window_sizes(window_starts, group_starts, group_sizes, group_ids)
+
+        points = path_df[['lat', 'lon']].values
+        query_idxs = self._find_window_sources(window_starts, window_sizes, group_starts, group_sizes, group_ids)
+        report(0.1)
+        # the closest points are most of the work, they take the rows from 10% to 90%
+        closest_progress = (lambda done, total: report(0.1 + 0.8 * done / total)) if progress else None
+        closest_idxs = utils.determine_closest_points_in_windows(points, query_idxs, window_starts, window_sizes,
+                                                                 n=len(self.neighbors_times), mode=self.neighbor_mode,
+                                                                 progress=closest_progress)
+
+        self.edges = self._build_edges(closest_idxs)
+        n_neighbors = len(self.neighbors_times)
+        self.neighbors = list(self.edges['indices'].reshape(-1, n_neighbors))
+        self.times = self.edges['times'].reshape(-1, n_neighbors).tolist()
+        self.all_distances = self.edges['distances'].reshape(-1, n_neighbors).tolist()
+
+    def _build_edges(self, closest_idxs):
+        """
+        Builds every edge of the path in one pass.
+        closest_idxs: (rows, n) positions of each row's closest neighbors in the path dataframe, closest first.
+        Returns CSR-style arrays: the edges of row i are at [indptr[i], indptr[i+1]),
+        `indices` holds the index of the neighbors in the path dataframe.
+        """
+        path_df = self.explorable_path_df
+        n_rows, n_neighbors = closest_idxs.shape
+        sources = np.repeat(np.arange(n_rows), n_neighbors)
+        targets = closest_idxs.ravel()
+        neighbor_ranks = np.tile(np.arange(n_neighbors), n_rows)
+
+        countries = path_df['country'].values
+        lat_rads = path_df['lat_rad'].values
+        lon_rads = path_df['lon_rad'].values
+
+        country_change = countries[sources] != countries[targets]
+        distances = utils.calculate_haversine_distance(lat_rads[sources], lon_rads[sources],
+                                                       lat_rads[targets], lon_rads[targets])
+        populations = path_df['population'].values[targets]
+        durations = utils.determine_durations(self.duration_matrix, neighbor_ranks, populations, country_change,
+                                              self.population_limit)
+        return {
+            'indptr': np.arange(0, n_rows * n_neighbors + 1, n_neighbors),
+            'indices': path_df.index.values[targets],
+            'neighbor_ranks': neighbor_ranks,
+            'country_change': country_change,
+            'populations': populations,
+            'times': durations,
+            'distances': np.round(distances).astype(int),
+        }
+
+    def _edges_from_lists(self):
+        """CSR-style edges from the per row lists of the iterative engine."""
+        path_df = self.explorable_path_df
+        n_neighbors = len(self.neighbors_times)
+        n_rows = len(self.neighbors)
+        indices = np.concatenate(self.neighbors) if n_rows else np.array([], dtype=int)
+        sources = np.repeat(np.arange(n_rows), n_neighbors)
+        targets = path_df.index.get_indexer(indices)
+        countries = path_df['country'].values
+        return {
+            'indptr': np.arange(0, n_rows * n_neighbors + 1, n_neighbors),
+            'indices': indices,
+            'neighbor_ranks': np.tile(np.arange(n_neighbors), n_rows),
+            'country_change': countries[sources] != countries[targets],
+            'populations': path_df['population'].values[targets],
+            'times': np.array(self.times, dtype=int).ravel(),
+            'distances': np.array(self.all_distances, dtype=int).ravel(),
+        }
+
+    @profiling.timed('reweight')
+    def reweight(self, neighbors_times=None, add_hours_country=None, add_hours_population=None, population_limit=None):
+        """
+        Recomputes the travel times of the filtered path for new penalties, without filtering it again.
+        The neighbors only depend on their number, so the times are a single lookup over the edge features
+        (neighbor rank, country change, population). The distances, and so a distance weighted graph, stay the same.
+        """
+        if self.edges is None:
+            raise ValueError('The path is not filtered yet! Run filter_path first.')
+        if neighbors_times is not None and len(neighbors_times) != len(self.neighbors_times):
+            raise ValueError('Invalid neighbors times. Must have the same number of neighbors, or filter the path again.')
+
+        if neighbors_times is not None:
+            self.neighbors_times = neighbors_times
+        if add_hours_country is not None:
+            self.add_hours_country = add_hours_country
+        if add_hours_population is not None:
+            self.add_hours_population = add_hours_population
+        if population_limit is not None:
+            self.population_limit = population_limit
+        self.duration_matrix = utils.build_duration_matrix(self.neighbors_times, self.add_hours_country,
+                                                           self.add_hours_population)
+
+        self.edges['times'] = utils.determine_durations(self.duration_matrix, self.edges['neighbor_ranks'],
+                                                        self.edges['populations'], self.edges['country_change'],
+                                                        self.population_limit)
+        self.times = self.edges['times'].reshape(-1, len(self.neighbors_times)).tolist()
         self.explorable_path_df['time_edges'] = self.times
-        self.explorable_path_df['distance_edges'] = self.all_distances
+
+    def _find_window_sources(self, window_starts, window_sizes, group_starts, group_sizes, group_ids):
+        """
+        The closest points are searched from the first point of each window sorted by the longitude percentile.
+        That is the row itself, unless other points share its longitude and one of them is sorted first.
+        """
+        n_points = len(group_ids)
+        query_idxs = window_starts.copy()
+        for i in np.flatnonzero(group_sizes[group_ids] > 1):
+            window = np.sort((window_starts[i] + np.arange(window_sizes[i])) % n_points)
+            pct = self._longitude_percentiles(group_ids[window], window_starts[i], group_starts, group_sizes)
+            query_idxs[i] = window[np.argsort(pct, kind='quicksort')[0]]
+        return query_idxs
+
+    @staticmethod
+    def _longitude_percentiles(groups, window_start, group_starts, group_sizes):
+        """
+        Percentile rank of longitude groups for a path shifted to start at `window_start`.
+        Matches `rank(pct=True)` of the shifted rankings: tied members get the average of their ranks.
+        """
+        n_points = group_starts[-1] + group_sizes[-1]
+        shifted_starts = (group_starts[groups] - window_start) % n_points
+        sizes = group_sizes[groups]
+        average_ranks = (sizes * shifted_starts + sizes * (sizes + 1) // 2) / sizes
+        return average_ranks / n_points
+
+    def _find_window_sizes(self, window_starts, group_starts, group_sizes, group_ids):
+        """
+        Finds the window size of every row at once.
+        The threshold only grows while iterating over the rows, so each row uses the largest threshold
+        needed by any previous row, increasing in the same 0.01 steps as `_apply_path_limit`.
+        """
+        n_points = len(group_ids)
+        n_groups = len(group_starts)
+
+        thresholds = [self.path_limit_thresh]
+        while thresholds[-1] < 1:
+            thresholds.append(thresholds[-1] + 0.01)
+        thresholds = np.array(thresholds)
+
+        # each window needs at least 20 points, i.e. the group of the 20th point in the shifted path must be included
+        twentieth = group_ids[(window_starts + 19) % n_points]
+        required = self._longitude_percentiles(twentieth, window_starts, group_starts, group_sizes)
+        threshold_steps = np.maximum.accumulate(np.searchsorted(thresholds, required, side='left'))
+        row_thresholds = thresholds[threshold_steps]
+        self.path_limit_thresh = float(row_thresholds[-1])
+
+        # binary search for the number of groups (in shifted order) below each row's threshold
+        low = np.zeros(n_points, dtype=int)
+        high = np.full(n_points, n_groups)
+        while np.any(high - low > 1):
+            middle = (low + high) // 2
+            groups = (group_ids + middle) % n_groups
+            below = self._longitude_percentiles(groups, window_starts, group_starts, group_sizes) <= row_thresholds
+            low = np.where(below, middle, low)
+            high = np.where(below, high, middle)
+
+        window_ends = group_starts[(group_ids + high) % n_groups]
+        return np.where(high == n_groups, n_points, (window_ends - window_starts) % n_points)
 
     def _shift_and_rank_longitudes(self, path_df, row):
         origin_sorted_index = list(path_df['lon']).index(row['lon'])
@@ -106,7 +332,7 @@ class PathExplorer:
     
     def _find_neighbors_and_calculate_time(self, row, filtered_path_df, current_point_country):
         points = filtered_path_df[['lat', 'lon']].values
-        closest_idxs = utils.determine_closest_points(points, n=len(self.neighbors_times))
+        closest_idxs = utils.determine_closest_points(points, n=len(self.neighbors_times), mode=self.neighbor_mode)
         indices_in_explorable_path = filtered_path_df.loc[closest_idxs[0]]['org_index'].values
         self.neighbors.append(indices_in_explorable_path)
 
@@ -1,20 +1,58 @@
 import numpy as np
 
-from path.optimizer import dijkstra
+import profiling
+from path.optimizer import CSRGraph, astar_csr, bidirectional_dijkstra_csr, dijkstra, dijkstra_csr
 from utils import determine_closest_points
 
-def path_finder(explorable_path, graph, vertices):
+def longitude_heuristic(graph, longitudes, start, end, moving_direction):
     '''
-    Finds the shortest route (based on distance) with dijkstra and then adjusts the time needed for each point.
-    Final distances in the reult dataframe are sorted, normalized and durations are adjusted using normalized distances.
+    Admissible A* heuristic for the journey: the remaining longitude to the end vertex,
+    scaled by the lowest cost per degree of longitude gained by any edge of the graph.
+    Every path to the end gains exactly that remaining longitude, so its cost can not be lower.
+    The longitude spans of zero cost edges (points closer than 0.5 km) are taken out of the progress first,
+    otherwise they would bring the cost per degree down to zero.
     Input:
-        explorable_path: PathExplorer(data, origin_city, origin_country, moving_direction)
-        graph: Graph(adjacency_list)
-        vertices (dict): dictionary containing Vertex(index, longitude)
-    Output:
-        chosen_path: shortest path found by dijkstra
-        cost: total cost (distance) for the chosen_path
-        result_df: final dataframe containing information for the shortest path found
+        graph: CSRGraph
+        longitudes: longitude of each vertex id
+        start, end: vertex ids of the start and the end
+        moving_direction: "E" or "W"
+    '''
+    sign = 1 if moving_direction == 'E' else -1
+    progress = (sign * (np.asarray(longitudes) - longitudes[start])) % 360  # longitude gained from the start
+
+    sources = np.repeat(np.arange(len(graph)), np.diff(graph.indptr))
+    gained = progress[graph.indices] - progress[sources]
+    free = (graph.weights <= 0) & (gained > 0)
+    progress = progress - _covered_length(progress[sources][free], progress[graph.indices][free], progress)
+
+    gained = progress[graph.indices] - progress[sources]
+    forward = (gained > 0) & (graph.weights > 0)
+    cost_per_degree = (graph.weights[forward] / gained[forward]).min() if forward.any() else 0
+    cost_per_degree *= 1 - 1e-9  # margin for floating point errors
+
+    return np.maximum(cost_per_degree * (progress[end] - progress), 0)
+
+def _covered_length(starts, ends, values):
+    '''Length of the union of the [start, end] intervals that lies below each value.'''
+    if not len(starts):
+        return np.zeros(len(values))
+    order = np.argsort(starts)
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+    # merging overlapping intervals
+    new_interval = np.r_[True, starts[1:] > ends[:-1]]
+    merged_starts = starts[new_interval]
+    merged_ends = ends[np.r_[np.flatnonzero(new_interval)[1:] - 1, len(ends) - 1]]
+    lengths = merged_ends - merged_starts
+    length_before = np.r_[0, np.cumsum(lengths)[:-1]]
+
+    interval = np.searchsorted(merged_starts, values, side='right') - 1
+    inside = np.clip(values - merged_starts[interval], 0, lengths[interval])
+    return np.where(interval < 0, 0, length_before[interval] + inside)
+
+def find_start_and_end(explorable_path):
+    '''
+    Index of the origin and of the end of the journey in the explorable path dataframe.
+    The end is the closest point to the origin among its previous neighbors in the graph.
     '''
     data = explorable_path.get_dataframe()
     origin_city = explorable_path.origin_city
@@ -28,14 +66,54 @@ def path_finder(explorable_path, graph, vertices):
     destination = destination.reset_index().rename(columns={'index':'org_index'})
 
     previous_neighbors = destination[['lat','lon']].values
-    prev_closest_neighbor = determine_closest_points(previous_neighbors, n=1)[-1]
+    prev_closest_neighbor = determine_closest_points(previous_neighbors, n=1, mode=explorable_path.neighbor_mode)[-1]
 
     end_index = destination.loc[prev_closest_neighbor]['org_index'].values[0]
+    return origin_index, end_index
+
+@profiling.timed('path_finder')
+def path_finder(explorable_path, graph, vertices=None, search='dijkstra'):
+    '''
+    Finds the shortest route (based on distance) with dijkstra and then adjusts the time needed for each point.
+    Final distances in the reult dataframe are sorted, normalized and durations are adjusted using normalized distances.
+    Input:
+        explorable_path: PathExplorer(data, origin_city, origin_country, moving_direction)
+        graph: CSRGraph.from_edges(explorable_path.edges, data.index) or Graph(adjacency_list)
+        vertices (dict): dictionary containing Vertex(index, longitude), only needed for Graph
+        search: "dijkstra", "astar" or "bidirectional". The last two need a CSRGraph and are experimental:
+                they settle about as many vertices as dijkstra on the journey ring, are slower,
+                and may return another path of the same cost.
+    Output:
+        chosen_path: shortest path found by dijkstra
+        cost: total cost (distance) for the chosen_path
+        result_df: final dataframe containing information for the shortest path found
+    '''
+    data = explorable_path.get_dataframe()
+    origin_city = explorable_path.origin_city
+    origin_index, end_index = find_start_and_end(explorable_path)
+
+    if search not in ['dijkstra', 'astar', 'bidirectional']:
+        raise ValueError('Invalid search. Must be "dijkstra", "astar" or "bidirectional".')
 
-    start = vertices[origin_index]
-    end = vertices[end_index]
+    with profiling.stage('search'):
+        if isinstance(graph, CSRGraph):
+            start = graph.vertex_id(origin_index)
+            end = graph.vertex_id(end_index)
+            if search == 'astar':
+                heuristic = longitude_heuristic(graph, data.loc[graph.labels, 'lon'].values, start, end,
+                                                explorable_path.moving_direction)
+                chosen_path, cost = astar_csr(graph, start, end, heuristic)
+            elif search == 'bidirectional':
+                chosen_path, cost = bidirectional_dijkstra_csr(graph, start, end)
+            else:
+                chosen_path, cost = dijkstra_csr(graph, start, end)
+        elif search != 'dijkstra':
+            raise ValueError(f'"{search}" search needs a CSRGraph.')
+        else:
+            start = vertices[origin_index]
+            end = vertices[end_index]
 
-    chosen_path, cost = dijkstra(graph, start, end)
+            chosen_path, cost = dijkstra(graph, start, end)
 
     if len(chosen_path) < 2:
         print(f'Last reachable point: {data.loc[chosen_path[0]]["city"]} ({chosen_path[0]})')
@@ -1,6 +1,7 @@
-import itertools
+import numpy as np
+import pandas as pd
 
-from heapq import heappush, heappop
+import profiling
     
 class Graph:
     def __init__(self, adjacency_list):
@@ -17,21 +18,27 @@ class Edge:
         self.vertex = vertex
     
 def dijkstra(graph, start, end):
-    previous = {v: None for v in graph.adjacency_list.keys()}
-    visited = {v: False for v in graph.adjacency_list.keys()}
-    costs = {v: float('inf') for v in graph.adjacency_list.keys()}
+    vertices = list(graph.adjacency_list.keys())
+    ids = {v: i for i, v in enumerate(vertices)}
+    previous = {v: None for v in vertices}
+    visited = {v: False for v in vertices}
+    costs = {v: float('inf') for v in vertices}
     costs[start] = 0
-    queue = PriorityQueue()
-    queue.add_task(0, start)
+    queue = IndexedHeap(len(vertices))
+    queue.push(0, ids[start])
     path = []
     last_visited = None 
     
     while queue:
-        removed_cost, removed = queue.pop_task()
+        removed_cost, removed = queue.pop()
+        removed = vertices[removed]
         visited[removed] = True
         last_visited = removed  # update the last visited vertex
 
         if removed is end:
+            if profiling.is_enabled():
+                profiling.count('heap_pushes', queue.counter)
+                profiling.count('heap_pops', sum(visited.values()))
             while previous[removed]:
                 path.append(removed.value)
                 removed = previous[removed]
@@ -46,41 +53,303 @@ def dijkstra(graph, start, end):
             if new_cost < costs[edge.vertex]:
                 costs[edge.vertex] = new_cost
                 previous[edge.vertex] = removed
-                queue.add_task(new_cost, edge.vertex)
+                queue.push(new_cost, ids[edge.vertex])
     # if no path is found.
+    if profiling.is_enabled():
+        profiling.count('heap_pushes', queue.counter)
+        profiling.count('heap_pops', sum(visited.values()))
     print(f'No complete path found!')
     return [last_visited.value], costs[last_visited]
 
-class PriorityQueue:
+class CSRGraph:
+    """
+    Graph stored as compressed sparse rows: the edges of vertex i are
+    indices[indptr[i]:indptr[i+1]] with the matching weights.
+    Vertices are integer ids, `labels` maps them back to the dataframe index.
+    """
+    def __init__(self, indptr, indices, weights, labels=None):
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.weights = np.asarray(weights)
+        self.labels = np.arange(len(self.indptr) - 1) if labels is None else np.asarray(labels)
+        self._label_index = pd.Index(self.labels)
 
-    def __init__(self):
-        self.pq = []  # list of entries arranged in a heap
-        self.entry_finder = {}  # mapping of tasks to entries
-        self.counter = itertools.count()  # unique sequence count
+    @classmethod
+    @profiling.timed('graph_construction')
+    def from_dataframe(cls, data, weights='distance_edges'):
+        """Builds the graph from the explorable path dataframe (adjacency_list and the chosen edges column)."""
+        lengths = data['adjacency_list'].map(len).values
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        if indptr[-1]:
+            neighbors = np.concatenate(data['adjacency_list'].values)
+            edge_weights = np.concatenate(data[weights].values)
+        else:
+            neighbors, edge_weights = np.array([], dtype=int), np.array([], dtype=int)
+        indices = data.index.get_indexer(neighbors)
+        return cls(indptr, indices, edge_weights, labels=data.index.values)
+
+    @classmethod
+    @profiling.timed('graph_construction')
+    def from_edges(cls, edges, labels, weights='distances'):
+        """
+        Builds the graph from the CSR-style `PathExplorer.edges` arrays, without going through the list columns.
+        labels: index of the explorable path dataframe, the edges' `indices` are mapped to their positions in it.
+        """
+        labels = pd.Index(labels)
+        return cls(edges['indptr'], labels.get_indexer(edges['indices']), edges[weights], labels=labels.values)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def vertex_id(self, label):
+        return self._label_index.get_loc(label)
+
+    def reverse(self):
+        """Same graph with every edge reversed, used for the backward search."""
+        sources = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind='stable')
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(self.indices, minlength=len(self)))))
+        return CSRGraph(indptr, sources[order], self.weights[order], labels=self.labels)
+
+def dijkstra_csr(graph, start, end, stats=None):
+    """
+    Dijkstra on a CSRGraph. start and end are vertex ids, the path is returned with the vertex labels.
+    stats (dict): optional, filled with the number of settled vertices.
+    """
+    return astar_csr(graph, start, end, heuristic=None, stats=stats)
+
+def astar_csr(graph, start, end, heuristic, stats=None):
+    """
+    A* on a CSRGraph. heuristic is a lower bound of the remaining cost for every vertex id,
+    it must be admissible and consistent for the path to be the shortest one. Without it, this is plain Dijkstra.
+    On the journey graphs, the end is the start after a full circle, so it settles about as many vertices as Dijkstra.
+    """
+    indptr = graph.indptr.tolist()
+    indices = graph.indices.tolist()
+    weights = graph.weights.tolist()
+    labels = graph.labels.tolist()
+
+    n_vertices = len(graph)
+    heuristic = [0] * n_vertices if heuristic is None else list(heuristic)
+    previous = [-1] * n_vertices
+    visited = [False] * n_vertices
+    costs = [float('inf')] * n_vertices
+    costs[start] = 0
+    queue = IndexedHeap(n_vertices)
+    queue.push(heuristic[start], start)
+    path = []
+    last_visited = None
+    settled = 0
+
+    while queue:
+        _, removed = queue.pop()
+        removed_cost = costs[removed]
+        visited[removed] = True
+        last_visited = removed  # update the last visited vertex
+        settled += 1
+
+        if removed == end:
+            profiling.count('heap_pushes', queue.counter)
+            profiling.count('heap_pops', settled)
+            if stats is not None:
+                stats['settled'] = settled
+            while previous[removed] != -1:
+                path.append(labels[removed])
+                removed = previous[removed]
+            path.append(labels[start])
+            return path[::-1], costs[end]
+
+        for edge in range(indptr[removed], indptr[removed + 1]):
+            vertex = indices[edge]
+            if visited[vertex]:
+                continue
+
+            new_cost = removed_cost + weights[edge]
+            if new_cost < costs[vertex]:
+                costs[vertex] = new_cost
+                previous[vertex] = removed
+                queue.push(new_cost + heuristic[vertex], vertex)
+    # if no path is found.
+    profiling.count('heap_pushes', queue.counter)
+    profiling.count('heap_pops', settled)
+    if stats is not None:
+        stats['settled'] = settled
+    print(f'No complete path found!')
+    return [labels[last_visited]], costs[last_visited]
+
+def bidirectional_dijkstra_csr(graph, start, end, stats=None):
+    """
+    Runs Dijkstra forward from start and backward from end (on the reversed graph) at the same time,
+    always expanding the side with the lower tentative cost, until the two searches cannot improve the best meeting point.
+    Experimental: on the journey graphs it settles about as many vertices as Dijkstra and is slower.
+    """
+    labels = graph.labels.tolist()
+    if start == end:
+        if stats is not None:
+            stats['settled'] = 0
+        return [labels[start]], 0
+
+    sides = []
+    for side_graph, source in ((graph, start), (graph.reverse(), end)):
+        n_vertices = len(side_graph)
+        costs = [float('inf')] * n_vertices
+        costs[source] = 0
+        queue = IndexedHeap(n_vertices)
+        queue.push(0, source)
+        sides.append({
+            'indptr': side_graph.indptr.tolist(),
+            'indices': side_graph.indices.tolist(),
+            'weights': side_graph.weights.tolist(),
+            'previous': [-1] * n_vertices,
+            'visited': [False] * n_vertices,
+            'costs': costs,
+            'queue': queue,
+        })
+    forward, backward = sides
+
+    best_cost = float('inf')
+    meeting = -1
+    last_visited = start
+    settled = 0
+
+    while forward['queue'] and backward['queue']:
+        forward_cost, _ = forward['queue'].peek()
+        backward_cost, _ = backward['queue'].peek()
+        if forward_cost + backward_cost >= best_cost:
+            break
+
+        side, other = (forward, backward) if forward_cost <= backward_cost else (backward, forward)
+        removed_cost, removed = side['queue'].pop()
+        side['visited'][removed] = True
+        settled += 1
+        if side is forward:
+            last_visited = removed
+
+        indptr, indices, weights = side['indptr'], side['indices'], side['weights']
+        costs, other_costs = side['costs'], other['costs']
+        for edge in range(indptr[removed], indptr[removed + 1]):
+            vertex = indices[edge]
+            new_cost = removed_cost + weights[edge]
+            if new_cost + other_costs[vertex] < best_cost:
+                best_cost = new_cost + other_costs[vertex]
+                meeting = vertex
+            if side['visited'][vertex]:
+                continue
+            if new_cost < costs[vertex]:
+                costs[vertex] = new_cost
+                side['previous'][vertex] = removed
+                side['queue'].push(new_cost, vertex)
+
+    profiling.count('heap_pushes', forward['queue'].counter + backward['queue'].counter)
+    profiling.count('heap_pops', settled)
+    if stats is not None:
+        stats['settled'] = settled
+    if meeting == -1:
+        print(f'No complete path found!')
+        return [labels[last_visited]], forward['costs'][last_visited]
+
+    path = []
+    vertex = meeting
+    while vertex != -1:
+        path.append(labels[vertex])
+        vertex = forward['previous'][vertex]
+    path.reverse()
+    vertex = backward['previous'][meeting]
+    while vertex != -1:
+        path.append(labels[vertex])
+        vertex = backward['previous'][vertex]
+    return path, best_cost
+
+class IndexedHeap:
+    """
+    Binary min-heap over the integer tasks 0..capacity-1, stored in preallocated arrays.
+    Pushing a task that is already queued decreases its priority and restores the heap in O(log n),
+    so tasks are always popped in priority order. Ties are popped in the order they were last pushed.
+    """
+    def __init__(self, capacity):
+        self.heap = [0] * capacity  # tasks arranged in a heap
+        self.positions = [-1] * capacity  # position of each task in the heap, -1 if not queued
+        self.priorities = [0] * capacity
+        self.orders = [0] * capacity  # push sequence for ties
+        self.counter = 0
+        self.size = 0
 
     def __len__(self):
-        return len(self.pq)
-
-    def add_task(self, priority, task):
-        # add a new task or update the priority of an existing task
-        if task in self.entry_finder:
-            self.update_priority(priority, task)
-            return self
-        count = next(self.counter)
-        entry = [priority, count, task]
-        self.entry_finder[task] = entry
-        heappush(self.pq, entry)
-
-    def update_priority(self, priority, task):
-        # update the priority of a task in place
-        entry = self.entry_finder[task]
-        count = next(self.counter)
-        entry[0], entry[1] = priority, count
-
-    def pop_task(self):
+        return self.size
+
+    def __contains__(self, task):
+        return self.positions[task] != -1
+
+    def _less(self, a, b):
+        priorities = self.priorities
+        return priorities[a] < priorities[b] or (priorities[a] == priorities[b] and self.orders[a] < self.orders[b])
+
+    def push(self, priority, task):
+        # add a new task or decrease the priority of a queued task
+        position = self.positions[task]
+        requeued = False
+        if position == -1:
+            position = self.size
+            self.size += 1
+        elif priority > self.priorities[task]:
+            raise ValueError('Priority of a queued task can only be decreased.')
+        else:
+            # same priority, the newer order moves the task after its ties
+            requeued = priority == self.priorities[task]
+        self.priorities[task] = priority
+        self.orders[task] = self.counter
+        self.counter += 1
+        if requeued:
+            self._sift_down(task, position)
+        else:
+            self._sift_up(task, position)
+
+    def peek(self):
+        # return the lowest priority task without removing it.
+        if not self.size:
+            raise KeyError('peek from an empty priority queue')
+        task = self.heap[0]
+        return self.priorities[task], task
+
+    def pop(self):
         # remove and return the lowest priority task. Raise KeyError if empty.
-        while self.pq:
-            priority, count, task = heappop(self.pq)
-            del self.entry_finder[task]
-            return priority, task
-        raise KeyError('pop from an empty priority queue')
\ No newline at end of file
+        if not self.size:
+            raise KeyError('pop from an empty priority queue')
+        heap = self.heap
+        task = heap[0]
+        self.positions[task] = -1
+        self.size -= 1
+        if self.size:
+            self._sift_down(heap[self.size], 0)
+        return self.priorities[task], task
+
+    def _sift_up(self, task, position):
+        heap, positions = self.heap, self.positions
+        while position:
+            parent_position = (position - 1) >> 1
+            parent = heap[parent_position]
+            if not self._less(task, parent):
+                break
+            heap[position] = parent
+            positions[parent] = position
+            position = parent_position
+        heap[position] = task
+        positions[task] = position
+
+    def _sift_down(self, task, position):
+        heap, positions, size = self.heap, self.positions, self.size
+        while True:
+            child_position = 2 * position + 1
+            if child_position >= size:
+                break
+            child = heap[child_position]
+            if child_position + 1 < size and self._less(heap[child_position + 1], child):
+                child_position += 1
+                child = heap[child_position]
+            if not self._less(child, task):
+                break
+            heap[position] = child
+            positions[child] = position
+            position = child_position
+        heap[position] = task
+        positions[task] = position
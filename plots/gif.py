@@ -0,0 +1,60 @@
+import os
+from io import BytesIO
+
+from PIL import Image
+from PIL.GifImagePlugin import getdata, getheader
+
+class GifStream:
+    """
+    Writes an animated GIF one frame at a time, only the frame being encoded is kept in memory.
+    Each frame is quantized to its own 256 color palette.
+    The GIF is written to `path`.tmp and only moved to `path` when it is closed complete,
+    if the `with` block fails the partial file is deleted.
+    """
+    def __init__(self, path, loop=0):
+        self.path = path
+        self.loop = loop
+        self.frames_written = 0
+        self._temp_path = f'{path}.tmp'
+        self._file = open(self._temp_path, 'wb')
+
+    def append(self, image, duration):
+        """
+        image: PNG bytes or a PIL image, all frames must have the same size
+        duration: seconds the frame stays on screen
+        """
+        if isinstance(image, (bytes, bytearray)):
+            image = Image.open(BytesIO(image))
+        frame = image.convert('RGB').quantize(256)
+        params = {'duration': int(round(duration * 1000)), 'include_color_table': True}
+
+        if self.frames_written == 0:
+            self.size = frame.size
+            header, _ = getheader(frame, info={'loop': self.loop, 'duration': params['duration']})
+            self._file.write(b''.join(header))
+        elif frame.size != self.size:
+            raise ValueError(f'Invalid frame size {frame.size}. Must be {self.size} like the first frame.')
+
+        self._file.write(b''.join(getdata(frame, **params)))
+        self.frames_written += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.write(b';')  # trailer
+            self._file.close()
+            os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """Closes and deletes the partial GIF, `path` is left as it was."""
+        if not self._file.closed:
+            self._file.close()
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
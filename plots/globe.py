@@ -1,36 +1,52 @@
-from copy import deepcopy
-from shutil import rmtree
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 import os
+import warnings
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-import imageio
+import plotly.io as pio
+
+import profiling
+from plots.gif import GifStream
+
+# seconds each GIF frame is shown: the previous imageio writer stored 1/60 s as 1 centisecond,
+# which the browsers and viewers play as 0.1 s
+FRAME_DURATION = 0.1
+COORDINATE_DECIMALS = 3  # of the frames of the lean interactive figure
+
+def _render_frame(frame_json, scale):
+    """PNG bytes of one frame. In the worker processes, each one starts its own kaleido instance."""
+    return pio.from_json(frame_json).to_image(format='png', scale=scale)
 
 class JourneyPlanner:
-    def __init__(self, data: pd.DataFrame, direction='E', origin_city='london', frame_dir='frames', gif_name='journey.gif', make_gif=False):
+    def __init__(self, data: pd.DataFrame, direction='E', origin_city='london', frame_dir=None, gif_name='journey.gif', make_gif=False,
+                 frame_duration=FRAME_DURATION):
+        """
+        frame_dir: deprecated and ignored, the GIF frames are no longer written to disk.
+        frame_duration: seconds each GIF frame is shown.
+        """
+        if frame_dir is not None:
+            warnings.warn('frame_dir is deprecated and ignored, the GIF frames are no longer written to disk.',
+                          DeprecationWarning, stacklevel=2)
         self.data = data.copy()
         self.direction = direction
         self.origin_city = origin_city
-        self.frame_dir = os.path.join(os.getcwd(), frame_dir)
         self.gif_name = gif_name
         self.make_gif = make_gif
-        self.image_paths = []
+        self.frame_duration = frame_duration
+        self._render_jobs = []
 
         self._prepare_data()
 
     def _prepare_data(self):
-        """For visualization purposes."""
-        self.data['point_color'] = self.data.apply(
-            lambda row: '#ffd500' if row['city'] == self.origin_city else '#2291bd', axis=1)
-        self.data['point_symbol'] = self.data.apply(
-            lambda row: 'star' if row['city'] == self.origin_city else 'circle', axis=1)
-        self.data['point_size'] = self.data.apply(
-            lambda row: 32 if row['city'] == self.origin_city else 7, axis=1)
+        """For visualization purposes. The origin is a large yellow star, the other cities small blue circles."""
+        is_origin = (self.data['city'] == self.origin_city).to_numpy()
+        self.data['point_color'] = np.where(is_origin, '#ffd500', '#2291bd')
+        self.data['point_symbol'] = np.where(is_origin, 'star', 'circle')
+        self.data['point_size'] = np.where(is_origin, 32, 7)
         
-    def _check_output_dir(self):
-        if not os.path.exists(self.frame_dir):
-            os.makedirs(self.frame_dir)
-    
     @staticmethod
     def add_figure_grid_lines(fig):
         for lat in range(-90, 91, 10):
@@ -71,9 +87,15 @@ class JourneyPlanner:
             height=1000,
             margin={'r': 0, 't': 0, 'l': 0, 'b': 0},
             showlegend=False,
-            title = title,
-            title_x=0.5,
-            title_y=0.98,
+            paper_bgcolor='#0d1118',
+            plot_bgcolor='#0d1118',
+            **self._titles_layout(title, uptime_title, distance_title))
+
+    @staticmethod
+    def _titles_layout(title, uptime_title, distance_title):
+        """The part of the layout that changes between the frames."""
+        return dict(
+            title = dict(text=title, x=0.5, y=0.98),
             annotations=[
                 dict(
                     x=0.5, 
@@ -96,9 +118,7 @@ class JourneyPlanner:
                     font=dict(color='Black'),
                     align='center',
                     borderpad=4
-                )],
-                paper_bgcolor='#0d1118',
-                plot_bgcolor='#0d1118')
+                )])
 
     def _add_menus_and_sliders(self, fig, frames):
         menus=[{
@@ -152,132 +172,228 @@ class JourneyPlanner:
             sliders = slides)
         fig.frames = frames
 
-    def create_fig_data(self):
-        total_time = self.data['normed_next_point_duration'].tolist()
-        total_distance = self.data['next_point_distance'].tolist()
+    @profiling.timed('create_fig_data')
+    def create_fig_data(self, progress=None):
+        """
+        Journey trace and titles of each frame. Frame i shows the first i+1 cities,
+        the totals come from the cumulative sums and the columns are sliced as arrays.
+        """
+        total_time = self.data['normed_next_point_duration'].to_numpy().cumsum()
+        total_distance = self.data['next_point_distance'].to_numpy().cumsum()
+        lats = self.data['lat'].to_numpy()
+        lons = self.data['lon'].to_numpy()
+        texts = self.data['accent_city'].to_numpy()
+        sizes = self.data['point_size'].to_numpy()
+        colors = self.data['point_color'].to_numpy()
+        symbols = self.data['point_symbol'].to_numpy()
+        origin = self.data.iloc[0]['city'].capitalize()
 
         figures = [] 
         titles = []
         for i in range(len(self.data)):
-            title = ('<span style="display: block; font-size: 14px; color: #0d1118;">'
-                    f'Journey started from {self.data.iloc[0]["city"].capitalize()}...'
-                    '</span>')
+            last = i == len(self.data) - 1
+            color = '#dc3a1a' if last else '#2291bd'
+            if last:
+                title = ('<span style="display: block; font-size: 14px; color: #0d1118;">'
+                        f'Reached back to {origin}!'
+                        '</span>')
+            else:
+                title = ('<span style="display: block; font-size: 14px; color: #0d1118;">'
+                        f'Journey started from {origin}...'
+                        '</span>')
             uptime_title = ('<span style="color:white; font-weight:bold;">Time:</span> '
-                            f'<span style="color:#2291bd; font-weight:bold;">{int(sum(total_time[: i+1]) // 24):02d}</span> '
+                            f'<span style="color:{color}; font-weight:bold;">{int(total_time[i] // 24):02d}</span> '
                             '<span style="color:white;">days and</span> '
-                            f'<span style="color:#2291bd; font-weight:bold;">{int(sum(total_time[: i+1]) % 24):02d}</span> '
+                            f'<span style="color:{color}; font-weight:bold;">{int(total_time[i] % 24):02d}</span> '
                             '<span style="color:white;">hours</span>')
             distance_title = ('<span style="color:white; font-weight:bold;">Distance:</span> '
-                             f'<span style="color:#2291bd; font-weight:bold;">{int(sum(total_distance[: i+1])):06,.0f}</span> '
+                             f'<span style="color:{color}; font-weight:bold;">{int(total_distance[i]):06,.0f}</span> '
                               '<span style="color:white;">km</span>')
             fig_data = go.Frame(
                     data=[go.Scattergeo(
-                            lat=self.data['lat'][: i+1],
-                            lon=self.data['lon'][: i+1],
-                            text=self.data['accent_city'][: i+1],
-                            marker=dict(size=self.data['point_size'][: i+1],
-                                        color=self.data['point_color'][: i+1],
-                                        symbol=self.data['point_symbol'][: i+1],
+                            lat=lats[: i+1],
+                            lon=lons[: i+1],
+                            text=texts[: i+1],
+                            marker=dict(size=sizes[: i+1],
+                                        color=colors[: i+1],
+                                        symbol=symbols[: i+1],
                                         opacity=0.8),
                             mode='markers+lines')],
                     name=f'frame_{i}'
                                 )        
-
-            if i == len(self.data) - 1:
-                title = ('<span style="display: block; font-size: 14px; color: #0d1118;">'
-                        f'Reached back to {self.data.iloc[0]["city"].capitalize()}!'
-                        '</span>')
-                uptime_title = ('<span style="color:white; font-weight:bold;">Time:</span> '
-                        f'<span style="color:#dc3a1a; font-weight:bold;">{int(sum(total_time) // 24):02d}</span> '
-                        '<span style="color:white;">days and</span> '
-                        f'<span style="color:#dc3a1a; font-weight:bold;">{int(sum(total_time) % 24):02d}</span> '
-                        '<span style="color:white;">hours</span>')
-                distance_title = ('<span style="color:white; font-weight:bold;">Distance:</span> '
-                                f'<span style="color:#dc3a1a; font-weight:bold;">{int(sum(total_distance)):06,.0f}</span> '
-                                '<span style="color:white;">km</span>')
             figures.append(fig_data)
             titles.append((title, uptime_title, distance_title))
+            if progress:
+                progress(i + 1, len(self.data))
 
         return figures, titles
     
-    def _create_fig(self):
-        figures, titles = self.create_fig_data()
-        figures_updated = []
+    def _create_fig(self, progress=None, lean=False):
+        """
+        The final figure and the frames of the journey.
+        The grid lines are only traces of the figure, each frame carries the journey trace (trace 0) and its titles.
+        The final frame is red, it is followed by a blue copy and then by the red one again.
+        lean: the frames only carry the rounded coordinates and the colors of the journey trace,
+        its other arrays are the ones of the figure (plotly ignores the elements past the points of a frame).
+        """
+        # the frame data is the first half of the work, the layouts of the frames the second half
+        data_progress = (lambda done, total: progress(done, 2 * total)) if progress else None
+        figures, titles = self.create_fig_data(progress=data_progress)
+        traces = [frame.data[0] for frame in figures]
+        final_trace = go.Scattergeo(traces[-1], marker_color='#dc3a1a')
+        # the journey ends in red, then flashes once in blue before the final red frame
+        traces = traces[:-1] + [final_trace, traces[-1], final_trace]
+        titles += [titles[-1], titles[-1]]
 
-        for i, frame in enumerate(figures):
-            fig = go.Figure(frame.data)
-            self.add_figure_grid_lines(fig)
-            self._update_figure_layout(fig, titles[i][0], titles[i][1], titles[i][2])
-            figures_updated.append(fig)
+        fig = go.Figure(final_trace)
+        self.add_figure_grid_lines(fig)
+        self._update_figure_layout(fig, *titles[-1])
 
-        figures_updated.append(deepcopy(fig))
-        fig.data[0].marker.color = '#dc3a1a'
-        figures_updated.append(fig)
-        interactive_fig = deepcopy(fig)
-        
         frames = []
-        for i, figure in enumerate(figures_updated):
-            frames.append(go.Frame(
-                data = figure.data,
-                layout = figure.layout,
-                name = f'frame_{i}'
-            ))
-        self._add_menus_and_sliders(interactive_fig, frames)
-        return fig, interactive_fig, figures_updated
+        for i, (trace, title) in enumerate(zip(traces, titles)):
+            if lean:
+                trace = go.Scattergeo(lat=trace.lat.round(COORDINATE_DECIMALS),
+                                      lon=trace.lon.round(COORDINATE_DECIMALS),
+                                      marker_color=trace.marker.color)
+            frames.append(go.Frame(data=[trace], traces=[0], layout=self._titles_layout(*title), name=f'frame_{i}'))
+            if progress:
+                progress(len(traces) + i + 1, 2 * len(traces))
+        return fig, frames
     
-    def show(self):
-        _, interactive_fig, _ = self._create_fig()
-        return interactive_fig
+    @profiling.timed('JourneyPlanner.show')
+    def show(self, progress=None, lean=False):
+        """
+        Interactive figure of the journey.
+        progress: optional callback, called with (steps done, total steps).
+        lean: smaller frames for the browser, with the coordinates rounded to COORDINATE_DECIMALS (about 100 m).
+        """
+        fig, frames = self._create_fig(progress, lean)
+        self._add_menus_and_sliders(fig, frames)
+        return fig
     
-    def gif(self, run=None):
+    @profiling.timed('JourneyPlanner.gif')
+    def gif(self, run=None, workers=None, progress=None, scale=5):
+        """
+        Saves the GIF of the journey. The frames are rendered in memory and streamed to the GIF,
+        a frame shown several times in a row is encoded once with a longer duration.
+        workers: number of processes rasterizing the frames, os.cpu_count() by default, 1 renders them in this process.
+        progress: optional callback, called with (frames rendered, total frames) as the frames complete.
+        scale: resolution of the frames, as a multiple of the 1000x1000 figure.
+        """
         run = run or self.make_gif
         if run:
-            gif_path, image_paths = self._frames_to_images()
+            gif_path, frame_ids = self._gif_frames()
+            runs = self._frame_runs(frame_ids)
+            last_run = {frame_id: i for i, (frame_id, _) in enumerate(runs)}
+            rendered = self._render_images(workers, progress, scale)
 
-            with imageio.get_writer(gif_path, mode='I', duration=0.2, loop=0, fps=60) as writer:
-                for i, image_path in enumerate(image_paths):
-                    image = imageio.imread(image_path)
-                    writer.append_data(image)
-                    del image
-                    if i % 20 == 0:
-                        print(f'Image {i}th created!')
-            
-            rmtree(self.frame_dir)
-            print(f'GIF saved as {gif_path}')
+            images = {}
+            try:
+                # a failed render deletes the partial GIF, the path is only written when the GIF is complete
+                with GifStream(gif_path, loop=0) as writer:
+                    for i, (frame_id, count) in enumerate(runs):
+                        # the frames are rendered in order, only the ones shown again later (flashing ending) are kept
+                        while frame_id not in images:
+                            rendered_id, image = next(rendered)
+                            images[rendered_id] = image
+                        writer.append(images[frame_id], duration=self.frame_duration * count)
+                        if last_run[frame_id] == i:
+                            del images[frame_id]
+            finally:
+                rendered.close()
+            print(f'GIF saved as {gif_path} ({len(runs)} frames)')
         else:
             print('GIF creation skipped!')
     
-    def _frames_to_images(self):
-        fig, _, frames = self._create_fig()
-        image_paths = []
-        self._check_output_dir()
+    def _gif_frames(self):
+        fig, frames = self._create_fig()
+        frame_ids = []
+        self._render_jobs = []
 
-        for i, fig in enumerate(frames):
-            self._write_image(image_paths, fig, f'frame_{i}.png')
-            if i % 20 == 0:
-                print(f'frame {i}th created!')
+        # the frames are drawn on the final figure, which keeps its grid lines
+        for frame in frames:
+            fig.data[0].update(frame.data[0].to_plotly_json())
+            fig.update_layout(frame.layout)
+            self._add_frame(frame_ids, fig)
 
-        second_last_frame_path = image_paths[-2]
-        last_frame_path = image_paths[-1]
+        second_last_frame_id = frame_ids[-2]
+        last_frame_id = frame_ids[-1]
         """repeat the last frames n times for more visibility for results and alternating flashing color!"""
         for _ in range(10): 
-            image_paths.append(second_last_frame_path)
-            image_paths.append(last_frame_path)
+            frame_ids.append(second_last_frame_id)
+            frame_ids.append(last_frame_id)
         """repeat the last frame to stay put with, having the second color"""
-        image_paths = image_paths + [last_frame_path] * 30 
+        frame_ids = frame_ids + [last_frame_id] * 30 
 
         gif_rotation = self.Gif(self)
-        i, image_paths = gif_rotation._initial_vertical_rotaion(image_paths, fig)
-        final_lat, image_paths = gif_rotation._horizontal_rotation(image_paths, fig, i)
-        gif_path, image_paths = gif_rotation._reverse_vertical_rotation(image_paths, fig, final_lat)
-        
-        return gif_path, image_paths
+        i, frame_ids = gif_rotation._initial_vertical_rotaion(frame_ids, fig)
+        final_lat, frame_ids = gif_rotation._horizontal_rotation(frame_ids, fig, i)
+        gif_path, frame_ids = gif_rotation._reverse_vertical_rotation(frame_ids, fig, final_lat)
+        return gif_path, frame_ids
     
-    def _write_image(self, image_paths, fig, frame_name, dir=None):
-        dir = dir or self.frame_dir
-        frame_path = os.path.join(dir, frame_name)
-        fig.write_image(frame_path, scale=5)
-        image_paths.append(frame_path)
+    def _add_frame(self, frame_ids, fig):
+        """
+        Queues the frame for `_render_images`. The figure is serialized now,
+        since the rotations keep updating the same figure.
+        """
+        frame_ids.append(len(self._render_jobs))
+        self._render_jobs.append(fig.to_json())
+
+    @staticmethod
+    def _frame_runs(frame_ids):
+        """[frame_id, times shown] of the consecutive repeats of the frames."""
+        runs = []
+        for frame_id in frame_ids:
+            if runs and runs[-1][0] == frame_id:
+                runs[-1][1] += 1
+            else:
+                runs.append([frame_id, 1])
+        return runs
+
+    @profiling.timed('render_frames')
+    def _render_images(self, workers=None, progress=None, scale=5):
+        """
+        Rasterizes the queued frames on a pool of processes and yields (frame_id, PNG bytes) in order.
+        At most two frames per worker are rendered ahead of the encoder.
+        progress counts the frames as they complete, in any order, so a slow frame does not hold back
+        the ones rendered after it. It is called from the calling thread, as the Streamlit elements need.
+        """
+        jobs, self._render_jobs = self._render_jobs, []
+        workers = workers or os.cpu_count()
+
+        def rendered(done):
+            profiling.count('frames_rendered')
+            if progress:
+                progress(done, len(jobs))
+            if done % 20 == 0:
+                print(f'frame {done}/{len(jobs)} created!')
+
+        if workers == 1:
+            for frame_id, frame_json in enumerate(jobs):
+                image = _render_frame(frame_json, scale)
+                rendered(frame_id + 1)
+                yield frame_id, image
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque(executor.submit(_render_frame, frame_json, scale) for frame_json in jobs[:2 * workers])
+            completed = set()  # pending futures already counted
+            n_completed = 0
+            for frame_id in range(len(jobs)):
+                while pending[0] not in completed:
+                    # waiting for the next frame in order, the others are counted as soon as they complete
+                    wait([future for future in pending if future not in completed], return_when=FIRST_COMPLETED)
+                    for future in pending:
+                        if future.done() and future not in completed:
+                            completed.add(future)
+                            n_completed += 1
+                            rendered(n_completed)
+                future = pending.popleft()
+                completed.discard(future)
+                image = future.result()
+                if frame_id + len(pending) + 1 < len(jobs):
+                    pending.append(executor.submit(_render_frame, jobs[frame_id + len(pending) + 1], scale))
+                yield frame_id, image
 
     class Gif:
         def __init__(self, journey_instance):
@@ -293,13 +409,13 @@ class JourneyPlanner:
             self.lon_sign = 1 if self.journey_instance.direction == 'E' else -1
 
         @staticmethod
-        def frame_multipication(image_paths, n):
+        def frame_multipication(frame_ids, n):
             """increases last frames for the visibility of the changes in the GIF"""
-            last_frame_path = image_paths[-1]
-            image_paths = image_paths + [last_frame_path] * n
-            return image_paths
+            last_frame_id = frame_ids[-1]
+            frame_ids = frame_ids + [last_frame_id] * n
+            return frame_ids
 
-        def _initial_vertical_rotaion(self, image_paths, fig):
+        def _initial_vertical_rotaion(self, frame_ids, fig):
             num = int(self.lat_diff / self.lat_division)
             """rotates vertically either up or down based on the initial latitude"""
             for i in range(num+1): 
@@ -308,13 +424,13 @@ class JourneyPlanner:
                         projection_rotation=dict(lat=self.default_lat + self.lat_sign * i * self.lat_division,
                                                  lon=self.default_lon,),
                     ))
-                self.journey_instance._write_image(image_paths, fig, f'frame_100{i}.png')
+                self.journey_instance._add_frame(frame_ids, fig)
 
-            image_paths = self.frame_multipication(image_paths, n=10)
+            frame_ids = self.frame_multipication(frame_ids, n=10)
             print('Initial vertical rotation done.')
-            return i, image_paths
+            return i, frame_ids
 
-        def _horizontal_rotation(self, image_paths, fig, index):
+        def _horizontal_rotation(self, frame_ids, fig, index):
             num = int(360/self.lon_division)
             final_lat = self.default_lat + self.lat_sign * index * self.lat_division
             """rotates horizontally around the globe"""
@@ -324,13 +440,13 @@ class JourneyPlanner:
                         projection_rotation=dict(lat=final_lat,
                                                  lon=self.default_lon + self.lon_sign * j * self.lon_division),
                     ))
-                self.journey_instance._write_image(image_paths, fig, f'frame_200{j}.png')
+                self.journey_instance._add_frame(frame_ids, fig)
 
             print('Horizontal rotation done.')
-            image_paths = self.frame_multipication(image_paths, n=10)
-            return final_lat, image_paths
+            frame_ids = self.frame_multipication(frame_ids, n=10)
+            return final_lat, frame_ids
         
-        def _reverse_vertical_rotation(self, image_paths, fig, final_lat):
+        def _reverse_vertical_rotation(self, frame_ids, fig, final_lat):
             num = int(self.lat_diff / self.lat_division)
             """rotates vertically in the reverse direction"""
             for i in range(num+1): 
@@ -339,9 +455,9 @@ class JourneyPlanner:
                         projection_rotation=dict(lat=final_lat - self.lat_sign * i * self.lat_division,  # "-" sign for reverse  
                                                  lon=self.default_lon),                 
                     ))
-                self.journey_instance._write_image(image_paths, fig, f'frame_300{i}.png')
+                self.journey_instance._add_frame(frame_ids, fig)
 
             print('Reverse vertical rotation done.')
-            image_paths = self.frame_multipication(image_paths, n=45)
+            frame_ids = self.frame_multipication(frame_ids, n=45)
             gif_path = os.path.join(os.getcwd(), self.journey_instance.gif_name)
-            return gif_path, image_paths
\ No newline at end of file
+            return gif_path, frame_ids
\ No newline at end of file
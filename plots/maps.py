@@ -11,10 +11,13 @@ class MapBuilder:
         self.geojson = geojson
 
     def city_data(self):
-        city_dist = self.initial_data.groupby(['country','country_lat','country_lon','geometry','code']).agg(
+        city_dist = self.initial_data.groupby(['country','country_lat','country_lon','code'], observed=True).agg(
             city_count = ('city', lambda x: x.count()),
             population = ('population', lambda x: x.sum()),
         ).reset_index()
+        # the compact city table has no geometry, it is looked up from the countries by code
+        geometries = self.country_data.drop_duplicates('code').set_index('code')['geometry']
+        city_dist['geometry'] = city_dist['code'].astype(str).map(geometries).values
         city_dist = gpd.GeoDataFrame(city_dist, geometry=city_dist['geometry'])
         return city_dist
     
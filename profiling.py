@@ -0,0 +1,142 @@
+'''
+Lightweight instrumentation of the pipeline: stage timers and counters.
+Disabled by default: timers and counters are then a lookup and nothing is recorded.
+The recording belongs to the current context (contextvars), so the threads of a process,
+e.g. the sessions of the Streamlit app, each record their own run.
+
+Usage:
+    import profiling
+
+    with profiling.recording() as recorder:
+        ... run a journey ...
+    print(recorder.to_json())
+'''
+import contextlib
+import contextvars
+import functools
+import json
+import time
+
+_recorder = contextvars.ContextVar('profiling_recorder', default=None)
+
+class Recorder:
+    """Stages and counters of one run."""
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    def report(self):
+        """Recorded stages (calls and total seconds, slowest first) and counters."""
+        stages = sorted(self.stages.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            'stages': {name: {'calls': calls, 'seconds': round(seconds, 6)} for name, (calls, seconds) in stages},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def to_json(self, path=None, **metadata):
+        """
+        Exports the report as JSON, with optional metadata (e.g. the journey parameters) to compare runs.
+        Writes it to `path` if given and returns the JSON string.
+        """
+        content = json.dumps({'metadata': metadata, **self.report()}, indent=2, default=str)
+        if path:
+            with open(path, 'w') as file:
+                file.write(content)
+        return content
+
+def enable(keep=False):
+    '''Starts recording in the current context, from scratch unless `keep` is True. Returns the recorder.'''
+    recorder = _recorder.get()
+    if recorder is None or not keep:
+        recorder = Recorder()
+    _recorder.set(recorder)
+    return recorder
+
+def disable():
+    _recorder.set(None)
+
+def is_enabled():
+    return _recorder.get() is not None
+
+def reset():
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.stages.clear()
+        recorder.counters.clear()
+
+@contextlib.contextmanager
+def recording(enabled=True):
+    '''
+    Records the block in a new recorder, which it yields (None if not enabled).
+    The previous state is restored on exit, also when the block raises.
+    '''
+    if not enabled:
+        yield None
+        return
+    token = _recorder.set(Recorder())
+    try:
+        yield _recorder.get()
+    finally:
+        _recorder.reset(token)
+
+class _Stage:
+    __slots__ = ('name', 'recorder', 'started')
+
+    def __init__(self, name, recorder):
+        self.name = name
+        self.recorder = recorder
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        calls, seconds = self.recorder.stages.get(self.name, (0, 0.0))
+        self.recorder.stages[self.name] = (calls + 1, seconds + elapsed)
+        return False
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+def stage(name):
+    '''Context manager timing the block as the stage `name`.'''
+    recorder = _recorder.get()
+    return _Stage(name, recorder) if recorder is not None else _NULL_STAGE
+
+def timed(name=None):
+    '''Decorator timing every call of the function as a stage, named after the function by default.'''
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            with _Stage(stage_name, recorder):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    '''Adds `value` to the counter `name`.'''
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.counters[name] = recorder.counters.get(name, 0) + value
+
+def report():
+    '''Report of the current recorder, see `Recorder.report`.'''
+    return (_recorder.get() or Recorder()).report()
+
+def to_json(path=None, **metadata):
+    '''JSON of the current recorder, see `Recorder.to_json`.'''
+    return (_recorder.get() or Recorder()).to_json(path, **metadata)
@@ -1,6 +1,8 @@
 import numpy as np
 from scipy.spatial import cKDTree
 
+import profiling
+
 def calculate_haversine_distance(lat1, lon1, lat2, lon2, R=6371):
 
     dlat = lat2 - lat1
@@ -13,6 +15,20 @@ def calculate_haversine_distance(lat1, lon1, lat2, lon2, R=6371):
 
     return distance
 
+def build_duration_matrix(n_neighbors_times=[2,4,8], 
+                          add_hours_country=2,
+                          add_hours_population=2):
+    '''
+    Builds the 2x2xk duration matrix used by `determine_duration`.
+    Indexed by [country change, nth closest point, high population].
+    '''
+    condition_matrix = np.array(n_neighbors_times) 
+
+    condition_matrix = np.stack((condition_matrix, condition_matrix + add_hours_country), axis=1)
+    condition_matrix = np.stack((condition_matrix, condition_matrix + add_hours_population), axis=0)
+
+    return condition_matrix
+
 def determine_duration(nth_closest_point, 
                        population, 
                        change_country=False, 
@@ -26,18 +42,24 @@ def determine_duration(nth_closest_point,
     Increments 2h for high population and 2h for country change.
     All criteria adjustable!
     '''
-    condition_matrix = np.array(n_neighbors_times) 
-
-    condition_matrix = np.stack((condition_matrix, condition_matrix + add_hours_country), axis=1)
-    condition_matrix = np.stack((condition_matrix, condition_matrix + add_hours_population), axis=0)
+    condition_matrix = build_duration_matrix(n_neighbors_times, add_hours_country, add_hours_population)
 
     high_population = np.where(population <= population_limit, 0, 1)
 
     return condition_matrix[int(change_country), nth_closest_point, high_population]
 
+def determine_durations(duration_matrix, nth_closest_points, populations, change_country, population_limit=200000):
+    '''
+    Vectorized `determine_duration` for many edges at once, with a pre-built duration matrix.
+    '''
+    high_population = np.where(populations <= population_limit, 0, 1)
+    return duration_matrix[np.asarray(change_country, dtype=int), nth_closest_points, high_population]
+
+@profiling.timed('identify_valid_points')
 def identify_valid_points(points, lat_boundry=2):
     '''
     Identify valid neighbors for each point considering latitude boundaries.
+    Builds the full NxN matrix, use `LatitudeBandIndex` for large datasets.
     '''
     lat_condition = np.logical_and(
         points[:, 0][:, None] <= points[:, 0] + lat_boundry,
@@ -46,20 +68,96 @@ def identify_valid_points(points, lat_boundry=2):
 
     return lat_condition
 
-def determine_closest_points(points, n=3):
+class LatitudeBandIndex:
     '''
-    Caclulates closest points based on KDTrees.
-    Due to the nature of latitudes and longitudes, 
-    this function augments the input to create mirrored points for the other side of the meridian based on longitudes.
-    Without this, the points are identified wrongly because of the earth's wrap around effect.
+    Sparse alternative to `identify_valid_points`.
+    Keeps the latitudes sorted once and finds the members of a point's latitude band with binary search,
+    so a lookup costs O(log N + k) instead of holding the whole NxN matrix in memory.
+    The boundaries are shifted the same way as in `identify_valid_points` to keep the exact same semantics.
+    '''
+    def __init__(self, points, lat_boundry=2):
+        self.lat_boundry = lat_boundry
+        self.lats = np.asarray(points)[:, 0]
+        self.order = np.argsort(self.lats, kind='stable')
+        sorted_lats = self.lats[self.order]
+        # point j is a member of i's band when: lat_i <= lat_j + boundry and lat_i >= lat_j - boundry
+        self._upper_lats = sorted_lats + lat_boundry
+        self._lower_lats = sorted_lats - lat_boundry
+
+    def __len__(self):
+        return len(self.lats)
+
+    def bounds(self, idxs):
+        '''Start and stop of the band(s) in the latitude-sorted order.'''
+        lats = self.lats[idxs]
+        start = np.searchsorted(self._upper_lats, lats, side='left')
+        stop = np.searchsorted(self._lower_lats, lats, side='right')
+        return start, stop
+
+    def query(self, idx):
+        '''Positional indices of the band members for a single point, in their original order.'''
+        start, stop = self.bounds(idx)
+        return np.sort(self.order[start:stop])
+
+    def query_batch(self, idxs):
+        '''Band members for several points at once. Returns a list of positional index arrays.'''
+        starts, stops = self.bounds(np.asarray(idxs))
+        return [np.sort(self.order[start:stop]) for start, stop in zip(starts, stops)]
+
+    def __getitem__(self, idx):
+        '''Boolean row, same as `identify_valid_points(points)[idx]`.'''
+        mask = np.zeros(len(self.lats), dtype=bool)
+        mask[self.query(idx)] = True
+        return mask
+
+def augment_points(points):
+    '''
+    Adds mirrored points for the other side of the meridian based on longitudes.
+    The mirrored copy of point i is at index i + len(points).
     '''
     points_augmented = np.copy(points)
     points_augmented[:, 1] = np.where(points[:, 1] < 0,
                                       points[:, 1] + 360,
                                       points[:, 1] - 360
                                       )
-    points_augmented = np.vstack((points, points_augmented))
+    return np.vstack((points, points_augmented))
+
+def to_unit_vectors(points):
+    '''
+    Projects (lat, lon) points in degrees to 3D unit vectors (ECEF on the unit sphere).
+    The chord distance between the vectors grows with the great-circle distance, so no mirroring is needed.
+    '''
+    lat = np.radians(points[:, 0])
+    lon = np.radians(points[:, 1])
+    return np.column_stack((np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon),
+                            np.sin(lat)))
+
+@profiling.timed('determine_closest_points')
+def determine_closest_points(points, n=3, mode='degrees'):
+    '''
+    Caclulates closest points based on KDTrees.
+    Due to the nature of latitudes and longitudes, 
+    this function augments the input to create mirrored points for the other side of the meridian based on longitudes.
+    Without this, the points are identified wrongly because of the earth's wrap around effect.
+    mode: "degrees" uses the planar distance of latitudes and longitudes,
+    "sphere" uses unit vectors so the closest points agree with the haversine distance.
+    '''
+    if mode not in ['degrees', 'sphere']:
+        raise ValueError('Invalid mode. Must be "degrees" or "sphere".')
 
+    if mode == 'sphere':
+        vectors = to_unit_vectors(points)
+        profiling.count('kd_trees_built')
+        _, indices = cKDTree(vectors).query(vectors, k=n+1)
+        # with n or fewer other points, the missing neighbors are len(points): the source is used instead,
+        # as the mirrored copy of the source is in degrees mode
+        indices = np.where(indices == len(points), np.arange(len(points))[:, None], indices)
+        return indices[:,1:n+1]
+
+    points_augmented = augment_points(points)
+
+    profiling.count('kd_trees_built')
     tree = cKDTree(points_augmented)
 
     # n+1 to exclude the source 
@@ -73,3 +171,54 @@ def determine_closest_points(points, n=3):
                                    closest_idxs - num_original_points
                                    )
     return mapped_closest_idxs
+
+@profiling.timed('determine_closest_points_in_windows')
+def determine_closest_points_in_windows(points, query_idxs, window_starts, window_sizes, n=3, mode='degrees', progress=None):
+    '''
+    Caclulates closest points of each query point among the points of its own window, with a single KDTree.
+    Windows are circular slices of the points: [start, start + size), wrapping around the end.
+    Same result as `determine_closest_points(points[window], n, mode)` for the query point, without building a tree per window.
+    The tree is queried for more neighbors than needed and the ones outside of the window are filtered out,
+    the rows that did not find enough neighbors are queried again with twice the number of neighbors.
+    progress: optional callback, called with (rows done, total rows). The rows are then queried in about 20 chunks.
+    '''
+    if mode not in ['degrees', 'sphere']:
+        raise ValueError('Invalid mode. Must be "degrees" or "sphere".')
+
+    num_original_points = len(points)
+    if mode == 'sphere':
+        points = to_unit_vectors(points)
+        tree = cKDTree(points)
+    else:
+        tree = cKDTree(augment_points(points))
+    profiling.count('kd_trees_built')
+    query_idxs, window_starts, window_sizes = map(np.asarray, (query_idxs, window_starts, window_sizes))
+
+    n_rows = len(query_idxs)
+    closest_idxs = np.empty((n_rows, n), dtype=int)
+    # the rows are independent, the chunks only matter for the progress
+    chunk_size = max(1, -(-n_rows // 20)) if progress else max(1, n_rows)
+    for chunk_start in range(0, n_rows, chunk_size):
+        pending = np.arange(chunk_start, min(chunk_start + chunk_size, n_rows))
+        k = 4 * (n + 1)
+        while len(pending):
+            k = min(k, tree.n)
+            _, indices = tree.query(points[query_idxs[pending]], k=k)
+            # finding the original index before augmentation
+            indices = indices % num_original_points
+            in_window = (indices - window_starts[pending, None]) % num_original_points < window_sizes[pending, None]
+
+            found = in_window.sum(axis=1) >= n + 1
+            if k == tree.n and not found.all():
+                raise ValueError(f'Not enough points in the window to find {n} closest points!')
+
+            # n+1 to exclude the source, keeping the order of the distances
+            first_in_window = np.argsort(~in_window[found], axis=1, kind='stable')[:, 1:n+1]
+            closest_idxs[pending[found]] = np.take_along_axis(indices[found], first_in_window, axis=1)
+
+            pending = pending[~found]
+            k *= 2
+        if progress:
+            progress(min(chunk_start + chunk_size, n_rows), n_rows)
+
+    return closest_idxs